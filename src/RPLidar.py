@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
-'''Animates distances and measurment quality'''
+'''Animates distances and measurment quality, or with "map" the occupancy grid'''
 from rplidar import RPLidar
 import matplotlib.pyplot as plt
 import numpy as np
 import matplotlib.animation as animation
+import sys
+from occupancy import OccupancyGrid
+from transform import scan_to_arrays
 
 PORT_NAME = '/dev/ttyUSB0'
 DMAX = 1000
@@ -34,6 +37,33 @@ def run():
     lidar.stop()
     lidar.disconnect()
 
+def update_map(num, iterator, grid, image):
+    angles, distances, _ = scan_to_arrays(next(iterator))
+    grid.integrate(angles, distances)
+    # The grid may have grown, so hand over its current probabilities and extent each frame
+    image.set_data(grid.probability())
+    image.set_extent(grid.extent())
+    return image,
+
+def run_map():
+    lidar = RPLidar(PORT_NAME)
+    grid = OccupancyGrid()
+    fig = plt.figure()
+    ax = plt.subplot(111)
+    image = ax.imshow(grid.probability(), extent=grid.extent(), origin='lower',
+                      cmap=plt.cm.Greys, vmin=0, vmax=1)
+    ax.set_aspect('equal')
+
+    iterator = lidar.iter_scans()
+    ani = animation.FuncAnimation(fig, update_map,
+        fargs=(iterator, grid, image), interval=50)
+    plt.show()
+    lidar.stop()
+    lidar.disconnect()
+
 if __name__ == '__main__':
-    run()
+    if sys.argv[1:] == ['map']:
+        run_map()
+    else:
+        run()
 
@@ -0,0 +1,163 @@
+"""End-to-end benchmark of the capture pipeline on simulated sensors.
+
+Runs wildbioscan.py --simulate in a scratch directory (the in-memory Firebase stands in
+for the network, files land in the scratch directory) for a fixed number of capture
+cycles at each requested speed, and collects the stats it writes on exit: per-stage,
+per-source and per-sensor-path p50/p95/p99 latency, sustained captures per second, CPU
+time and peak RSS. Results are written as JSON together with the commit and host, and
+can be compared with an earlier results file to catch throughput regressions:
+
+    python bench.py --output bench_main.json
+    python bench.py --baseline bench_main.json   # exits 1 on a regression
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SPEEDS = [10.0, 50.0]  # simulated speed-ups; the capture interval shrinks with the speed
+CYCLES = 40            # capture cycles per run
+REPEATS = 3            # runs per speed; the median of each figure is reported
+TOLERANCE = 0.15       # fractional change that counts as a regression
+RUN_TIMEOUT = 600      # seconds before a run is abandoned
+
+
+def commit():
+    """The checked-out commit, with a + suffix when the tree has local changes."""
+    try:
+        head = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, check=True,
+                              capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE,
+                               capture_output=True, text=True).stdout.strip()
+        return head + ("+" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_once(speed, cycles, headless=True):
+    """Run one simulated capture session and return the stats it wrote."""
+    with tempfile.TemporaryDirectory(prefix="wildbioscan-bench-") as scratch:
+        stats_path = os.path.join(scratch, "stats.json")
+        env = dict(os.environ, SESSION_DIR=scratch,
+                   UPLOAD_QUEUE_PATH=os.path.join(scratch, "upload_queue.db"))
+        command = [sys.executable, os.path.join(HERE, "wildbioscan.py"), "--simulate", str(speed),
+                   "--cycles", str(cycles), "--stats", stats_path]
+        if headless:
+            command.append("--headless")
+        result = subprocess.run(command, cwd=scratch, env=env, capture_output=True, text=True,
+                                timeout=RUN_TIMEOUT)
+        if not os.path.exists(stats_path):
+            raise RuntimeError(f"Benchmark run at {speed}x wrote no stats "
+                               f"(exit code {result.returncode}):\n{result.stdout[-2000:]}"
+                               f"{result.stderr[-2000:]}")
+        with open(stats_path) as f:
+            return json.load(f)
+
+
+def median_of(runs):
+    """Element-wise median of the numbers in equally shaped stats dicts."""
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: median_of([run[key] for run in runs if key in run]) for key in first}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return statistics.median(runs)
+    return first
+
+
+def flatten(stats, prefix=""):
+    """{"stages.upload.p95_ms": 1.2, ...} for every number in nested stats."""
+    flat = {}
+    for key, value in stats.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Regressions of results against baseline: lower throughput or higher p95 latency."""
+    regressions = []
+    for speed, current in results["runs"].items():
+        previous = baseline["runs"].get(speed)
+        if previous is None:
+            continue
+        now, before = flatten(current), flatten(previous)
+        for name, value in now.items():
+            old = before.get(name)
+            if old is None:
+                continue
+            if name == "captures_per_s" and value < old * (1 - tolerance):
+                regressions.append(f"{speed}x {name}: {old:.2f} -> {value:.2f}")
+            # Sub-millisecond latencies are mostly scheduling noise
+            elif name.endswith("p95_ms") and old >= 1.0 and value > old * (1 + tolerance):
+                regressions.append(f"{speed}x {name}: {old:.1f} -> {value:.1f} ms")
+    return regressions
+
+
+def report(speed, stats):
+    print(f"{speed}x: {stats['captures_per_s']:.2f} captures/s "
+          f"({stats['captures']:.0f} of {stats['cycles']:.0f} cycles in {stats['elapsed_s']:.1f} s), "
+          f"CPU {stats['cpu_s']:.1f} s ({stats['cpu_s'] / stats['elapsed_s']:.0%}), "
+          f"RSS {stats['max_rss_mb']:.0f} MB")
+    for group in ("sources", "stages", "paths"):
+        for name, values in stats[group].items():
+            print(f"  {group[:-1]:6} {name:12} p50 {values['p50_ms']:8.2f} ms  "
+                  f"p95 {values['p95_ms']:8.2f} ms  p99 {values['p99_ms']:8.2f} ms  "
+                  f"n={values['count'] if 'count' in values else values['processed']:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the capture pipeline on simulated sensors")
+    parser.add_argument("--speeds", type=float, nargs="+", default=SPEEDS)
+    parser.add_argument("--cycles", type=int, default=CYCLES)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--render", action="store_true", help="include point-cloud rendering")
+    parser.add_argument("--output", help="results file (default bench_<commit>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    options = parser.parse_args()
+
+    results = {
+        "commit": commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": {"machine": platform.machine(), "system": platform.platform(),
+                 "python": platform.python_version(), "cpus": os.cpu_count()},
+        "cycles": options.cycles,
+        "repeats": options.repeats,
+        "runs": {},
+    }
+    for speed in options.speeds:
+        runs = [run_once(speed, options.cycles, headless=not options.render)
+                for _ in range(options.repeats)]
+        stats = median_of(runs)
+        results["runs"][f"{speed:g}"] = stats
+        report(f"{speed:g}", stats)
+
+    output = options.output or f"bench_{results['commit'] or 'unknown'}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, options.tolerance)
+        print(f"Compared with {baseline.get('commit')}: "
+              f"{len(regressions) or 'no'} regression{'s' if len(regressions) != 1 else ''}")
+        for line in regressions:
+            print(f"  {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
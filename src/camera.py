@@ -0,0 +1,119 @@
+"""Long-lived camera backends exposing the capture_image(output_path) contract."""
+
+import os
+import subprocess
+import threading
+import time
+
+TUNING_FILE = "/usr/share/libcamera/ipa/rpi/pisp/imx519.json"
+WARMUP = 1.0  # seconds for AE/AWB to settle after the sensor starts streaming
+
+# 8x8 grey baseline JPEG written by the fake backend
+PLACEHOLDER_JPEG = bytes.fromhex(
+    'ffd8ffe000104a46494600010100000100010000ffdb004300100b0c0e0c0a100e0d0e12'
+    '11101318281a181616183123251d283a333d3c3933383740485c4e404457453738506d51'
+    '575f626768673e4d71797064785c656763ffc0000b080008000801011100ffc400140001'
+    '00000000000000000000000000000000ffc4001410010000000000000000000000000000'
+    '0000ffda0008010100003f003fffd9'
+)
+
+
+class Picamera2Camera:
+    """Opens the IMX519 once, keeps it streaming and grabs full-resolution stills on demand."""
+
+    def __init__(self, tuning_file=TUNING_FILE, warmup=WARMUP):
+        from picamera2 import Picamera2
+
+        tuning = None
+        if tuning_file and os.path.exists(tuning_file):
+            tuning = Picamera2.load_tuning_file(os.path.basename(tuning_file),
+                                                dir=os.path.dirname(tuning_file))
+        self.picam2 = Picamera2(tuning=tuning)
+        # Two buffers let the sensor keep streaming while a still is being encoded
+        self.picam2.configure(self.picam2.create_still_configuration(buffer_count=2))
+        self.picam2.start()
+        time.sleep(warmup)
+        self.lock = threading.Lock()
+
+    def capture_image(self, output_path):
+        """Save the next full-resolution frame as a JPEG."""
+        try:
+            with self.lock:
+                self.picam2.capture_file(output_path)
+            print(f"Image captured and saved as {output_path}")
+            return True
+        except Exception as e:
+            print(f"Error capturing image: {str(e)}")
+            return False
+
+    def close(self):
+        self.picam2.stop()
+        self.picam2.close()
+
+
+class LibcameraStillCamera:
+    """Fallback that runs libcamera-still for every frame, used when Picamera2 is unavailable."""
+
+    def __init__(self, tuning_file=TUNING_FILE, timeout_ms=5000):
+        self.tuning_file = tuning_file
+        self.timeout_ms = timeout_ms
+
+    def capture_image(self, output_path):
+        """Capture an image using the Raspberry Pi camera."""
+        cmd = ["libcamera-still", "--output", output_path,
+               "--timeout", str(self.timeout_ms), "--tuning-file", self.tuning_file]
+        try:
+            subprocess.run(cmd, check=True)
+            print(f"Image captured and saved as {output_path}")
+            return True
+        except subprocess.CalledProcessError as e:
+            print(f"Camera command failed with exit code {e.returncode}")
+            return False
+        except Exception as e:
+            print(f"Error capturing image: {str(e)}")
+            return False
+
+    def close(self):
+        pass
+
+
+class FakeCamera:
+    """Writes a placeholder JPEG after an optional delay, for testing without a camera."""
+
+    def __init__(self, delay=0.0, fail_every=0, data=PLACEHOLDER_JPEG):
+        self.delay = delay
+        self.fail_every = fail_every
+        self.data = data  # JPEG bytes written for every capture
+        self.captures = 0
+
+    def capture_image(self, output_path):
+        self.captures += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail_every and self.captures % self.fail_every == 0:
+            print("Error capturing image: simulated failure")
+            return False
+        with open(output_path, "wb") as f:
+            f.write(self.data)
+        return True
+
+    def close(self):
+        pass
+
+
+BACKENDS = {
+    "picamera2": Picamera2Camera,
+    "libcamera-still": LibcameraStillCamera,
+    "fake": FakeCamera,
+}
+
+
+def open_camera(backend="auto", **kwargs):
+    """Open a camera backend by name; "auto" prefers Picamera2 and falls back to libcamera-still."""
+    if backend != "auto":
+        return BACKENDS[backend](**kwargs)
+    try:
+        return Picamera2Camera(**kwargs)
+    except Exception as e:
+        print(f"Picamera2 unavailable ({str(e)}), falling back to libcamera-still")
+        return LibcameraStillCamera(tuning_file=kwargs.get("tuning_file", TUNING_FILE))
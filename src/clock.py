@@ -0,0 +1,124 @@
+"""Central clock service: monotonic nanosecond sample stamps, wall-clock mapping and per-path latency."""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import metrics
+from tracing import tracer
+
+ANCHOR_SAMPLES = 5  # paired clock reads when anchoring, the tightest pair wins
+WINDOW = 4096       # most recent latencies kept per path for percentiles
+PERCENTILES = (50, 95, 99)
+
+
+def percentiles(samples, qs=PERCENTILES):
+    """Nearest-rank percentiles of samples as {"p50": ..., ...}, zeros when there are none."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{q}": 0 for q in qs}
+    return {f"p{q}": ordered[min(len(ordered) - 1, max(0, -(-q * len(ordered) // 100) - 1))]
+            for q in qs}
+
+
+class LatencyStats:
+    """Running latency statistics for one sensor path, in nanoseconds.
+
+    Count, mean and max cover the whole run; percentiles cover the last WINDOW samples.
+    """
+
+    def __init__(self, window=WINDOW, histogram=None):
+        self.histogram = histogram  # metrics.Histogram fed every latency, if set
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.last = 0
+        self.recent = deque(maxlen=window)
+
+    def add(self, latency_ns):
+        self.count += 1
+        self.total += latency_ns
+        self.last = latency_ns
+        self.recent.append(latency_ns)
+        if self.histogram is not None:
+            self.histogram.observe_ns(latency_ns)
+        if latency_ns > self.max:
+            self.max = latency_ns
+
+    def as_dict(self):
+        mean = self.total / self.count if self.count else 0.0
+        stats = {"count": self.count, "mean_ms": mean / 1e6,
+                 "max_ms": self.max / 1e6, "last_ms": self.last / 1e6}
+        stats.update({f"{name}_ms": value / 1e6 for name, value in percentiles(self.recent).items()})
+        return stats
+
+
+class SensorClock:
+    """Stamps samples with time.monotonic_ns() and maps the stamps to wall-clock time.
+
+    Monotonic stamps never step backwards (NTP, RTC-less boots) so they are safe for
+    ordering and fusing samples; wall time is only derived for storage and display.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = {}
+        self.anchor()
+
+    def anchor(self):
+        """(Re)anchor the monotonic-to-wall mapping, e.g. after NTP sync in the field."""
+        best = None
+        for _ in range(ANCHOR_SAMPLES):
+            before = time.monotonic_ns()
+            wall = time.time_ns()
+            after = time.monotonic_ns()
+            if best is None or after - before < best[0]:
+                best = (after - before, (before + after) // 2, wall)
+        _, self.mono_ref, self.wall_ref = best
+
+    def now(self):
+        """Current monotonic time in nanoseconds."""
+        return time.monotonic_ns()
+
+    def to_wall_ns(self, stamp):
+        return self.wall_ref + (stamp - self.mono_ref)
+
+    def to_wall(self, stamp):
+        """Wall-clock time in seconds (like time.time()) for a monotonic stamp."""
+        return self.to_wall_ns(stamp) / 1e9
+
+    def age(self, stamp):
+        """Seconds elapsed since a monotonic stamp."""
+        return (time.monotonic_ns() - stamp) / 1e9
+
+    def record(self, path, started):
+        """Record the latency of a sensor path that began at started; returns the end stamp."""
+        ended = time.monotonic_ns()
+        with self.lock:
+            stats = self.paths.get(path)
+            if stats is None:
+                stats = self.paths[path] = LatencyStats(histogram=metrics.histogram(
+                    "sensor_latency_seconds", "Latency of each sensor path sample.", path=path))
+            stats.add(ended - started)
+        if tracer.enabled:
+            tracer.record(path, started, ended, {"sensor": path})
+        return ended
+
+    @contextmanager
+    def measure(self, path):
+        """Time the enclosed block as one sample of the given sensor path."""
+        started = time.monotonic_ns()
+        try:
+            yield started
+        finally:
+            self.record(path, started)
+
+    def latency(self):
+        """Latency statistics for every measured path."""
+        with self.lock:
+            return {path: stats.as_dict() for path, stats in self.paths.items()}
+
+
+# Shared by every sensor reader so all stamps come from the same timebase
+sensor_clock = SensorClock()
@@ -0,0 +1,73 @@
+"""Thumbnail, preview and re-encoded copies of captured images, built in worker processes."""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+THUMBNAIL_SIZE = (320, 240)
+PREVIEW_SIZE = (1280, 960)
+JPEG_QUALITY = 85
+WORKERS = 2  # the Pi 5 has four cores; leave two for acquisition
+
+
+def derivative_path(image_path, kind, extension="jpg"):
+    """Path of a derivative written beside the original, e.g. image_1.preview.jpg."""
+    root, _ = os.path.splitext(image_path)
+    return f"{root}.{kind}.{extension}"
+
+
+def planned_paths(image_path, reencode=None):
+    """kind -> path of every derivative make_derivatives writes for an image."""
+    paths = {"preview": derivative_path(image_path, "preview"),
+             "thumbnail": derivative_path(image_path, "thumb")}
+    if reencode:
+        paths[reencode] = derivative_path(image_path, "preview", reencode)
+    return paths
+
+
+def make_derivatives(image_path, reencode=None, quality=JPEG_QUALITY):
+    """Write the thumbnail and preview (and optionally a webp/avif copy); returns kind -> path."""
+    from PIL import Image
+
+    paths = planned_paths(image_path, reencode)
+    with Image.open(image_path) as image:
+        # draft() makes the JPEG decoder scale by 1/2-1/8 in the DCT, so a 16 MP frame
+        # is never decoded at full size
+        image.draft("RGB", PREVIEW_SIZE)
+        preview = image.convert("RGB")
+    preview.thumbnail(PREVIEW_SIZE)
+    preview.save(paths["preview"], "JPEG", quality=quality)
+
+    thumbnail = preview.copy()
+    thumbnail.thumbnail(THUMBNAIL_SIZE)
+    thumbnail.save(paths["thumbnail"], "JPEG", quality=quality)
+
+    if reencode:
+        preview.save(paths[reencode], reencode.upper(), quality=quality)
+    return paths
+
+
+class DerivativePool:
+    """Process pool that builds derivatives off the acquisition process.
+
+    The workers are forked as soon as the pool is created, so create it before starting
+    any thread.
+    """
+
+    def __init__(self, workers=WORKERS, reencode=None):
+        self.reencode = reencode
+        self.pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context("fork"))
+        # A fork pool starts every worker on its first job
+        self.pool.submit(os.getpid).result()
+
+    def submit(self, image_path):
+        """Start building derivatives for an image; returns a Future of kind -> path."""
+        return self.pool.submit(make_derivatives, image_path, self.reencode)
+
+    def paths(self, image_path):
+        """kind -> path the derivatives of an image will have, known before they are built."""
+        return planned_paths(image_path, self.reencode)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,77 @@
+"""Burst-read BNO055 snapshots: every fusion output from one I2C transaction."""
+
+from collections import namedtuple
+
+import numpy as np
+
+from clock import sensor_clock
+
+# ACC_DATA_X_LSB (0x08) through TEMP (0x34) is one contiguous block on register page 0
+DATA_START = 0x08
+DATA_LENGTH = 45
+WORDS = 22  # little-endian int16 values before the int8 temperature
+
+# Register scaling in the default unit selection (m/s^2, uT, rad/s, degrees),
+# matching what the adafruit_bno055 properties return
+SCALES = np.array(
+    [1 / 100.0] * 3                    # acceleration, m/s^2
+    + [1 / 16.0] * 3                   # magnetic, uT
+    + [np.pi / 180.0 / 16.0] * 3       # gyro, rad/s
+    + [1 / 16.0] * 3                   # euler (heading, roll, pitch), degrees
+    + [1 / float(1 << 14)] * 4         # quaternion (w, x, y, z)
+    + [1 / 100.0] * 3                  # linear acceleration, m/s^2
+    + [1 / 100.0] * 3                  # gravity, m/s^2
+)
+
+ImuSnapshot = namedtuple("ImuSnapshot", [
+    "timestamp", "acceleration", "magnetic", "gyro", "euler", "quaternion",
+    "linear_acceleration", "gravity", "temperature",
+])
+
+_FIELDS = [  # (field, first value, value count) within the decoded block
+    ("acceleration", 0, 3), ("magnetic", 3, 3), ("gyro", 6, 3), ("euler", 9, 3),
+    ("quaternion", 12, 4), ("linear_acceleration", 16, 3), ("gravity", 19, 3),
+]
+
+
+def decode(block):
+    """Scale a raw 45-byte register block into a float array of 22 values and the temperature."""
+    values = np.frombuffer(block, dtype="<i2", count=WORDS) * SCALES
+    temperature = int(np.frombuffer(block, dtype=np.int8, count=1, offset=WORDS * 2)[0])
+    return values, temperature
+
+
+def to_snapshot(values, temperature, timestamp):
+    """Split decoded values into an ImuSnapshot of plain float tuples."""
+    values = values.tolist()
+    fields = {name: tuple(values[start:start + count]) for name, start, count in _FIELDS}
+    return ImuSnapshot(timestamp=timestamp, temperature=temperature, **fields)
+
+
+class BurstImu:
+    """Reads the whole BNO055 data block at once instead of one property per field."""
+
+    def __init__(self, sensor):
+        # BNO055_I2C keeps its adafruit_bus_device.I2CDevice as i2c_device
+        self.device = sensor.i2c_device
+        self.block = bytearray(DATA_LENGTH)
+        self.register = bytes([DATA_START])
+
+    def read_block(self):
+        """Fill the block buffer in a single write-then-read transaction and return its timestamp."""
+        timestamp = sensor_clock.now()
+        with self.device as i2c:
+            i2c.write_then_readinto(self.register, self.block)
+        sensor_clock.record("imu", timestamp)
+        return timestamp
+
+    def read_values(self):
+        """Return (monotonic ns, values, temperature) with values as a float array of 22 readings."""
+        timestamp = self.read_block()
+        values, temperature = decode(self.block)
+        return timestamp, values, temperature
+
+    def snapshot(self):
+        """Read every fusion output from the same sensor update into one ImuSnapshot."""
+        timestamp, values, temperature = self.read_values()
+        return to_snapshot(values, temperature, timestamp)
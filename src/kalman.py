@@ -0,0 +1,188 @@
+"""Small constant-velocity Kalman filter for the BNO055, run at the full IMU rate.
+
+Each measured axis is modelled as a value and its rate of change. Every axis shares the
+same noise settings, so they share one 2x2 covariance: the covariance recursion is done
+once per step in plain floats and only the (2, axes) state is a NumPy array, updated in
+place. State and covariance are reported in the same layout as the filterpy
+KalmanFilter(dim_x=6, dim_z=3) this replaces: [values..., rates...].
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from clock import sensor_clock
+
+RATE = 100.0              # Hz, the BNO055 fusion output rate
+PROCESS_NOISE = 1.0       # spectral density of the (white) rate noise
+MEASUREMENT_NOISE = 1.0   # measurement variance
+INITIAL_VARIANCE = 1000.0
+
+
+class ConstantVelocityFilter:
+    """Kalman filter with a dt-aware constant-velocity model per axis."""
+
+    def __init__(self, axes=3, process_noise=PROCESS_NOISE, measurement_noise=MEASUREMENT_NOISE,
+                 initial_variance=INITIAL_VARIANCE, steady_state_dt=None):
+        self.axes = axes
+        self.q = process_noise
+        self.r = measurement_noise
+        self.state = np.zeros((2, axes))  # row 0 values, row 1 rates
+        self.value = self.state[0]
+        self.rate = self.state[1]
+        self.innovation = np.zeros(axes)
+        self.p00 = self.p11 = initial_variance
+        self.p01 = 0.0
+        self.k0 = self.k1 = 0.0
+        self.steady = False
+        if steady_state_dt:
+            self.use_steady_state(steady_state_dt)
+
+    def use_steady_state(self, dt, tolerance=1e-12, max_iterations=100000):
+        """Converge the covariance for a fixed dt and freeze the gain from then on.
+
+        Steady-state gain skips the covariance recursion entirely, which is valid once the
+        filter has settled and samples arrive at a steady rate.
+        """
+        k0 = k1 = None
+        for _ in range(max_iterations):
+            self._predict_covariance(dt)
+            self._update_covariance()
+            if k0 is not None and abs(self.k0 - k0) < tolerance and abs(self.k1 - k1) < tolerance:
+                break
+            k0, k1 = self.k0, self.k1
+        self.steady = True
+
+    def _predict_covariance(self, dt):
+        q = self.q
+        p00, p01, p11 = self.p00, self.p01, self.p11
+        # P = F P F^T + Q with F = [[1, dt], [0, 1]] and white-noise Q
+        self.p00 = p00 + dt * (2.0 * p01 + dt * p11) + q * dt ** 3 / 3.0
+        self.p01 = p01 + dt * p11 + q * dt ** 2 / 2.0
+        self.p11 = p11 + q * dt
+
+    def _update_covariance(self):
+        s = self.p00 + self.r
+        self.k0 = self.p00 / s
+        self.k1 = self.p01 / s
+        p00, p01 = self.p00, self.p01
+        self.p00 = (1.0 - self.k0) * p00
+        self.p01 = (1.0 - self.k0) * p01
+        self.p11 = self.p11 - self.k1 * p01
+
+    def predict(self, dt):
+        """Advance the state by dt seconds."""
+        self.value += dt * self.rate
+        if not self.steady:
+            self._predict_covariance(dt)
+
+    def update(self, z):
+        """Correct the state with a measurement of every axis."""
+        if not self.steady:
+            self._update_covariance()
+        np.subtract(z, self.value, out=self.innovation)
+        self.value += self.k0 * self.innovation
+        self.rate += self.k1 * self.innovation
+
+    def step(self, z, dt):
+        self.predict(dt)
+        self.update(z)
+
+    @property
+    def x(self):
+        """State in filterpy layout, [values..., rates...]."""
+        return self.state.reshape(-1).copy()
+
+    @property
+    def P(self):
+        """Full covariance in filterpy layout."""
+        block = np.array([[self.p00, self.p01], [self.p01, self.p11]])
+        return np.kron(block, np.eye(self.axes))
+
+
+class ImuFilter:
+    """Reads the IMU and filters every sample, one step() per period of a scheduler task.
+
+    imu is a BurstImu; step() must always be called from the same thread because the
+    block buffer is reused on every read.
+    """
+
+    def __init__(self, imu, rate=RATE, fields=slice(0, 3), **filter_args):
+        self.imu = imu
+        self.period = 1.0 / rate  # dt of the first step, before there is a previous sample
+        self.fields = fields  # values of the decoded IMU block fed to the filter (acceleration)
+        width = len(range(*fields.indices(22)))
+        self.filter = ConstantVelocityFilter(axes=width, **filter_args)
+        self.lock = threading.Lock()
+        self.last = None
+        self.samples = 0
+        self.errors = 0
+
+    def step(self):
+        """Read and filter one sample; returns (timestamp, values, temperature), None on a read error."""
+        try:
+            timestamp, values, temperature = self.imu.read_values()
+        except Exception as e:
+            self.errors += 1
+            print(f"IMU read error: {str(e)}")
+            return None
+        dt = self.period if self.last is None else (timestamp - self.last) / 1e9
+        with self.lock, sensor_clock.measure("kalman"):
+            self.filter.step(values[self.fields], dt)
+            self.last = timestamp
+            self.samples += 1
+        return timestamp, values, temperature
+
+    def latest(self):
+        """Return (monotonic ns stamp, state, covariance) of the newest filtered sample."""
+        with self.lock:
+            return self.last, self.filter.x, self.filter.P
+
+
+if __name__ == '__main__':
+    # Benchmark against filterpy configured like the filter wildbioscan.py used to run
+    import sys
+
+    steps = 20000
+    dt = 1.0 / RATE
+    rng = np.random.default_rng(0)
+    measurements = rng.normal(0.0, 1.0, (steps, 3)) + np.array([0.0, 0.0, 9.81])
+
+    started = time.perf_counter()
+    ours = ConstantVelocityFilter()
+    for z in measurements:
+        ours.step(z, dt)
+    ours_time = (time.perf_counter() - started) / steps
+    steady = ConstantVelocityFilter(steady_state_dt=dt)
+    started = time.perf_counter()
+    for z in measurements:
+        steady.step(z, dt)
+    steady_time = (time.perf_counter() - started) / steps
+    print(f"constant-velocity filter: {ours_time * 1e6:.1f} us/step, "
+          f"steady-state gain: {steady_time * 1e6:.1f} us/step")
+
+    try:
+        import_start = time.perf_counter()
+        from filterpy.kalman import KalmanFilter
+        import_time = time.perf_counter() - import_start
+    except ImportError:
+        print("filterpy not installed, skipping comparison")
+        sys.exit(0)
+
+    kf = KalmanFilter(dim_x=6, dim_z=3)
+    kf.F = np.kron(np.array([[1.0, dt], [0.0, 1.0]]), np.eye(3))
+    kf.H = np.zeros((3, 6))
+    kf.H[:, :3] = np.eye(3)
+    kf.P *= INITIAL_VARIANCE
+    kf.R = np.eye(3) * MEASUREMENT_NOISE
+    kf.Q = np.kron(PROCESS_NOISE * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]]), np.eye(3))
+    kf.x = np.zeros(6)
+    started = time.perf_counter()
+    for z in measurements:
+        kf.predict()
+        kf.update(z)
+    filterpy_time = (time.perf_counter() - started) / steps
+    assert np.allclose(kf.x, ours.x, atol=1e-6) and np.allclose(kf.P, ours.P, atol=1e-6)
+    print(f"filterpy: {filterpy_time * 1e6:.1f} us/step ({filterpy_time / ours_time:.0f}x slower), "
+          f"import {import_time * 1e3:.0f} ms; states match")
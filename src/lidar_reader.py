@@ -0,0 +1,94 @@
+"""Background RPLidar reader keeping the most recent timestamped scans in a ring buffer."""
+
+import bisect
+import threading
+from collections import deque
+
+from clock import sensor_clock
+
+CAPACITY = 32          # scans kept, about 6 s of history at 5.5 Hz
+MAX_BUF_MEAS = 3000    # measurements the driver may buffer before it reports an overrun
+RESTART_DELAY = 0.5    # seconds to wait before restarting the scan after an error
+
+
+class LidarReader(threading.Thread):
+    """Keeps the RPLidar scanning continuously so callers never wait for a rotation.
+
+    callback, if given, is called with (timestamp, scan) for every rotation on the reader
+    thread, so it must finish well within a rotation.
+    """
+
+    def __init__(self, lidar, capacity=CAPACITY, max_buf_meas=MAX_BUF_MEAS, callback=None):
+        super().__init__(name="lidar-reader", daemon=True)
+        self.lidar = lidar
+        self.callback = callback
+        self.max_buf_meas = max_buf_meas
+        self.scans = deque(maxlen=capacity)  # (monotonic ns, scan) pairs, oldest first
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.scan_count = 0
+        self.errors = 0
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                # One long-lived generator: the scan command is sent once and the
+                # serial input is drained continuously, so it never overruns
+                started = sensor_clock.now()
+                for scan in self.lidar.iter_scans(max_buf_meas=self.max_buf_meas):
+                    # Stamped when the rotation completes; the latency is the wait for it
+                    timestamp = sensor_clock.record("lidar", started)
+                    # The callback runs first, so whatever it derives from a scan is
+                    # ready by the time the scan is visible to latest() and nearest()
+                    if self.callback is not None:
+                        try:
+                            self.callback(timestamp, scan)
+                        except Exception as e:
+                            print(f"LiDAR scan callback error: {str(e)}")
+                    with self.lock:
+                        self.scans.append((timestamp, scan))
+                        self.scan_count += 1
+                    if self.stopping.is_set():
+                        break
+                    started = sensor_clock.now()
+            except Exception as e:
+                if self.stopping.is_set():
+                    break
+                self.errors += 1
+                print(f"LiDAR read error, restarting scan: {str(e)}")
+                try:
+                    self.lidar.stop()
+                    self.lidar.clean_input()
+                except Exception:
+                    pass
+                self.stopping.wait(RESTART_DELAY)
+
+    def latest(self):
+        """Return the newest (timestamp, scan) pair, or None before the first rotation."""
+        with self.lock:
+            return self.scans[-1] if self.scans else None
+
+    def nearest(self, timestamp):
+        """Return the buffered (timestamp, scan) pair closest to a monotonic ns stamp, or None if empty."""
+        with self.lock:
+            scans = list(self.scans)
+        if not scans:
+            return None
+        times = [t for t, _ in scans]
+        i = bisect.bisect_left(times, timestamp)
+        if i == 0:
+            return scans[0]
+        if i == len(scans):
+            return scans[-1]
+        before, after = scans[i - 1], scans[i]
+        return before if timestamp - before[0] <= after[0] - timestamp else after
+
+    def stop(self):
+        """Stop the reader thread and the scan."""
+        self.stopping.set()
+        self.join(timeout=2.0)
+        if self.is_alive():
+            # Still inside iter_scans; a stop command now would race it on the serial port
+            print("LiDAR reader did not stop in time, leaving the scan running")
+            return
+        self.lidar.stop()
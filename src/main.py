@@ -3,7 +3,9 @@ import adafruit_vl53l4cd
 import time
 import csv
 import os
-import subprocess
+from camera import open_camera
+from clock import sensor_clock
+from tof_reader import TofReader
 
 i2c = board.I2C()
 vl53 = adafruit_vl53l4cd.VL53L4CD(i2c)
@@ -12,18 +14,14 @@ timeout = 0.5  # Timeout in seconds
 interval = 5   # Interval in seconds
 
 vl53.start_ranging()
+tof_interrupt_pin = os.getenv('TOF_INTERRUPT_PIN')
+tof_reader = TofReader(vl53, interrupt_pin=int(tof_interrupt_pin) if tof_interrupt_pin else None)
+tof_reader.start()
+
+camera = open_camera(os.getenv('CAMERA_BACKEND', 'auto'))
 
 def capture_image(output_path):
-    try:
-        # Execute the libcamera-still command and capture the output
-        cmd = f"libcamera-still --output {output_path} --timeout 5000 --tuning-file /usr/share/libcamera/ipa/rpi/pisp/imx519.json"
-        subprocess.run(cmd, shell=True, check=True)
-        print(f"Image captured and saved as {output_path}")
-    except subprocess.CalledProcessError as e:
-        print(f"Error: libcamera-still command failed with exit code {e.returncode}")
-        print(f"Output: {e.output.decode('utf-8')}")
-    except Exception as e:
-        print(f"Error: {str(e)}")
+    return camera.capture_image(output_path)
 
 # Open the CSV file in append mode
 with open("sensor_data.csv", "a", newline='') as csvfile:
@@ -36,28 +34,22 @@ with open("sensor_data.csv", "a", newline='') as csvfile:
 
     try:
         while True:
-            start_time = time.time()
-
-            # Get the current Unix timestamp
-            timestamp = int(time.time())
-
-            # Construct the output filename with the timestamp
-            output_filename = f"image_{timestamp}.jpg"
-            output_path = os.path.join(os.getcwd(), output_filename)
+            start_time = time.monotonic()
 
-            # Capture the image
-            capture_image(output_path)
+            # Capture the image, named by its nanosecond wall-clock stamp so names never collide
+            with sensor_clock.measure("camera") as started:
+                output_filename = f"image_{sensor_clock.to_wall_ns(started)}.jpg"
+                output_path = os.path.join(os.getcwd(), output_filename)
+                capture_image(output_path)
+            timestamp = sensor_clock.to_wall(started)
 
             # Wait for sensor data or timeout
-            timeout_start = time.time()
-            while not vl53.data_ready:
-                if time.time() - timeout_start > timeout:
-                    print("Timeout waiting for sensor data.")
-                    break
+            reading = tof_reader.wait_next(timeout)
+            if reading is None:
+                print("Timeout waiting for sensor data.")
 
-            if vl53.data_ready:
-                vl53.clear_interrupt()
-                distance = vl53.distance - calibration_val
+            if reading is not None:
+                distance = reading.distance - calibration_val
 
                 # Write the data to the CSV file
                 writer.writerow({"Timestamp": timestamp, "Height (cm)": distance, "Image Path": output_path})
@@ -65,9 +57,12 @@ with open("sensor_data.csv", "a", newline='') as csvfile:
                 print(f"Distance: {distance} cm, Timestamp: {timestamp}, Image Path: {output_path}")
 
             # Wait for the remaining time until the next interval
-            elapsed_time = time.time() - start_time
+            elapsed_time = time.monotonic() - start_time
             remaining_time = interval - elapsed_time
             if remaining_time > 0:
                 time.sleep(remaining_time)
     except KeyboardInterrupt:
         print("Program interrupted. Data saved to sensor_data.csv.")
+    finally:
+        tof_reader.stop()
+        camera.close()
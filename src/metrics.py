@@ -0,0 +1,356 @@
+"""Runtime metrics for the capture daemon: counters, gauges and HDR-style latency histograms.
+
+Recording is a single deque.append, which is atomic under the GIL, so the hot loop
+never takes a lock and never folds; pending values are folded into the totals in
+batches by the registry's background fold thread every FOLD_INTERVAL, and when a scrape
+or snapshot reads them. Histograms bin nanosecond
+latencies log-linearly (HdrHistogram style): 64 sub-buckets per power of two, so any
+recorded value and every percentile is resolved to within 1.6%.
+
+The registry is rendered in the Prometheus text format by MetricsServer (localhost
+only by default) and written to disk as JSON by SnapshotWriter.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+SUB_BITS = 7           # 2^SUB_BITS linear buckets, then 2^(SUB_BITS - 1) per power of two
+MAX_BITS = 40          # values up to 2^40 ns (about 18 minutes); larger ones are clamped
+FOLD_INTERVAL = 1.0    # seconds between background folds, bounding the pending values
+QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+# Prometheus histogram boundaries (s), 1-2-5 steps from 10 us to 100 s
+BOUNDARIES = [m * 10.0 ** e for e in range(-5, 2) for m in (1, 2, 5)] + [100.0]
+PORT = 9108
+SNAPSHOT_INTERVAL = 60.0  # seconds
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def bucket_index(values):
+    """HDR bucket of each int64 nanosecond value."""
+    values = np.clip(np.asarray(values, dtype=np.int64), 0, (1 << MAX_BITS) - 1)
+    # frexp's exponent is the bit length, exact below 2^53
+    shift = np.maximum(np.frexp(values.astype(np.float64))[1] - SUB_BITS, 0)
+    return (shift << (SUB_BITS - 1)) + (values >> shift)
+
+
+def bucket_bounds(count):
+    """(lower, upper) nanosecond bounds of the first count buckets, upper exclusive."""
+    index = np.arange(count, dtype=np.int64)
+    shift = np.maximum((index >> (SUB_BITS - 1)) - 1, 0)
+    mantissa = np.where(index < (1 << SUB_BITS), index, index - (shift << (SUB_BITS - 1)))
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+BUCKETS = int(bucket_index([(1 << MAX_BITS) - 1])[0]) + 1
+LOWER, UPPER = bucket_bounds(BUCKETS)
+
+
+class Counter:
+    """Monotonic count; inc() only appends to a pending log."""
+
+    kind = "counter"
+
+    def __init__(self, function=None):
+        self.function = function  # read at collection time instead of counting, if set
+        self._pending = deque()
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        self._pending.append(amount)
+
+    def _fold(self):
+        with self._lock:
+            pending = self._pending
+            total = 0
+            for _ in range(len(pending)):
+                total += pending.popleft()
+            self._value += total
+
+    @property
+    def value(self):
+        if self.function is not None:
+            return self.function()
+        self._fold()
+        return self._value
+
+
+class Gauge:
+    """Current value: set() is a single attribute store, or a function read on collection."""
+
+    kind = "gauge"
+
+    def __init__(self, function=None):
+        self.function = function
+        self._value = 0.0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self.function() if self.function is not None else self._value
+
+
+class Histogram:
+    """Log-linear histogram of latencies, recorded in nanoseconds."""
+
+    kind = "histogram"
+
+    def __init__(self):
+        self._pending = deque()
+        self._counts = np.zeros(BUCKETS, dtype=np.int64)
+        self._sum = 0
+        self._max = 0
+        self._lock = threading.Lock()
+
+    def observe_ns(self, value):
+        self._pending.append(value)
+
+    def observe(self, seconds):
+        self._pending.append(int(seconds * 1e9))
+
+    def _fold(self):
+        with self._lock:
+            pending = self._pending
+            # popleft never loses a value appended concurrently, unlike swapping the deque
+            values = np.fromiter((pending.popleft() for _ in range(len(pending))), dtype=np.int64)
+            if not len(values):
+                return
+            self._counts += np.bincount(bucket_index(values), minlength=BUCKETS)
+            self._sum += int(values.sum())
+            self._max = max(self._max, int(values.max()))
+
+    def summary(self):
+        """count, sum, max and QUANTILES, in seconds; each quantile is its bucket's upper bound."""
+        self._fold()
+        with self._lock:
+            counts = self._counts.copy()
+            total, largest = self._sum, self._max
+        count = int(counts.sum())
+        cumulative = np.cumsum(counts)
+        quantiles = {}
+        for q in QUANTILES:
+            index = int(np.searchsorted(cumulative, max(1, int(np.ceil(q * count)))))
+            quantiles[f"p{q * 100:g}"] = (min(int(UPPER[min(index, BUCKETS - 1)]) - 1, largest) / 1e9
+                                          if count else 0.0)
+        return {"count": count, "sum": total / 1e9, "max": largest / 1e9, **quantiles,
+                "cumulative": cumulative}
+
+    def buckets(self, cumulative):
+        """Cumulative counts at BOUNDARIES, from summary()["cumulative"]."""
+        limits = np.searchsorted(UPPER, np.array(BOUNDARIES) * 1e9, side="right")
+        return [int(cumulative[i - 1]) if i else 0 for i in limits]
+
+
+class Registry:
+    """Metric families by name, each holding one metric per label set."""
+
+    def __init__(self, prefix="wildbioscan_", fold_interval=FOLD_INTERVAL):
+        self.prefix = prefix
+        self.fold_interval = fold_interval
+        self.lock = threading.Lock()
+        self.families = {}  # name -> (kind, help, {label tuple: metric})
+        self._folder = None
+
+    def fold(self):
+        """Fold every metric's pending values into its totals."""
+        for _, _, _, series in self._collect():
+            for _, metric in series:
+                if hasattr(metric, "_fold"):
+                    metric._fold()
+
+    def _fold_forever(self):
+        while True:
+            time.sleep(self.fold_interval)
+            self.fold()
+
+    def _metric(self, cls, name, help, labels, **kwargs):
+        name = self.prefix + name
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            kind, _, series = self.families.setdefault(name, (cls.kind, help, {}))
+            if kind != cls.kind:
+                raise ValueError(f"Metric {name} is already registered as a {kind}")
+            if self._folder is None:
+                # Started with the first metric, so recording threads never fold themselves
+                self._folder = threading.Thread(target=self._fold_forever, name="metrics-fold",
+                                                daemon=True)
+                self._folder.start()
+            metric = series.get(key)
+            if metric is None:
+                metric = series[key] = cls(**kwargs)
+            elif kwargs.get("function") is not None:
+                # Re-registering rebinds the function, e.g. to a restarted pipeline's queue
+                metric.function = kwargs["function"]
+            return metric
+
+    def counter(self, name, help="", function=None, **labels):
+        return self._metric(Counter, name, help, labels, function=function)
+
+    def gauge(self, name, help="", function=None, **labels):
+        return self._metric(Gauge, name, help, labels, function=function)
+
+    def histogram(self, name, help="", **labels):
+        return self._metric(Histogram, name, help, labels)
+
+    def _collect(self):
+        with self.lock:
+            return [(name, kind, help, list(series.items()))
+                    for name, (kind, help, series) in sorted(self.families.items())]
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, kind, help, series in self._collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in series:
+                labels = ",".join(f'{k}="{v}"' for k, v in key)
+                braces = f"{{{labels}}}" if labels else ""
+                try:
+                    if kind != "histogram":
+                        lines.append(f"{name}{braces} {float(metric.value):g}")
+                        continue
+                    summary = metric.summary()
+                except Exception:
+                    continue  # a failing gauge function must not break the whole scrape
+                separator = "," if labels else ""
+                for boundary, count in zip(BOUNDARIES, metric.buckets(summary["cumulative"])):
+                    lines.append(f'{name}_bucket{{{labels}{separator}le="{boundary:g}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {summary["count"]}')
+                lines.append(f"{name}_sum{braces} {summary['sum']:g}")
+                lines.append(f"{name}_count{braces} {summary['count']}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """All metrics as a JSON-ready dict, with histogram quantiles in seconds."""
+        families = {}
+        for name, kind, help, series in self._collect():
+            entries = []
+            for key, metric in series:
+                try:
+                    if kind == "histogram":
+                        value = metric.summary()
+                        del value["cumulative"]
+                    else:
+                        value = metric.value
+                except Exception:
+                    continue
+                entries.append({"labels": dict(key), "value": value})
+            families[name] = {"type": kind, "help": help, "series": entries}
+        return {"timestamp": time.time(), "metrics": families}
+
+
+class MetricsServer(threading.Thread):
+    """Serves the registry at http://host:port/metrics from a daemon thread."""
+
+    def __init__(self, registry, port=PORT, host="127.0.0.1"):
+        super().__init__(name="metrics-server", daemon=True)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes every few seconds would flood the console
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def run(self):
+        self.server.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SnapshotWriter(threading.Thread):
+    """Writes registry snapshots to path every interval seconds, and once more on stop."""
+
+    def __init__(self, registry, path, interval=SNAPSHOT_INTERVAL):
+        super().__init__(name="metrics-snapshot", daemon=True)
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopping = threading.Event()
+
+    def write(self):
+        # Written aside and renamed, so a reader or a power cut never sees half a file
+        partial = self.path + ".tmp"
+        with open(partial, "w") as f:
+            json.dump(self.registry.snapshot(), f, default=float)
+        os.replace(partial, self.path)
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                print(f"Metrics snapshot error: {str(e)}")
+
+    def stop(self):
+        self.stopping.set()
+        self.join(timeout=2.0)
+        self.write()
+
+
+# Shared by the clock, the orchestrator and the capture script, so one endpoint serves all
+metrics = Registry()
+
+
+if __name__ == '__main__':
+    # Cost of recording in the hot loop, and histogram accuracy against exact percentiles
+    import timeit
+    import urllib.request
+
+    registry = Registry()
+    histogram = registry.histogram("example_seconds", "Example latency", stage="test")
+    counter = registry.counter("example_total", "Example count", stage="test")
+    rng = np.random.default_rng(8)
+    latencies = rng.lognormal(np.log(2e6), 1.0, 200000).astype(np.int64)  # ns, around 2 ms
+    n = len(latencies)
+    values = iter(latencies.tolist())
+    observe = timeit.timeit(lambda: histogram.observe_ns(next(values)), number=n) / n
+    increment = timeit.timeit(counter.inc, number=n) / n
+    empty = timeit.timeit(lambda: None, number=n) / n
+    print(f"observe_ns {(observe - empty) * 1e9:.0f} ns, inc {(increment - empty) * 1e9:.0f} ns "
+          f"per call (after {empty * 1e9:.0f} ns of call overhead)")
+
+    summary = histogram.summary()
+    assert summary["count"] == n and counter.value == n
+    counter.inc(3)
+    time.sleep(registry.fold_interval * 1.5)
+    assert not counter._pending and counter._value == n + 3
+    for q in QUANTILES:
+        exact = np.quantile(latencies, q) / 1e9
+        error = summary[f"p{q * 100:g}"] / exact - 1
+        assert abs(error) < 0.02, (q, error)
+    print(f"quantiles within 2% of exact; p99 {summary['p99'] * 1e3:.2f} ms")
+
+    server = MetricsServer(registry, port=0)
+    server.start()
+    with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+        text = response.read().decode()
+    server.stop()
+    assert f'wildbioscan_example_seconds_count{{stage="test"}} {n}' in text
+    print(f"served {len(text.splitlines())} lines of exposition")
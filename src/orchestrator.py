@@ -0,0 +1,202 @@
+"""Asyncio acquisition orchestrator: runs capture stages as concurrent tasks joined by bounded queues."""
+
+import asyncio
+import time
+from collections import deque
+
+from clock import WINDOW, percentiles
+from metrics import metrics
+from tracing import tracer
+
+# Backpressure policies for the queue in front of a stage
+BLOCK = "block"              # Wait for space, no record is lost but the upstream stage waits
+DROP_OLDEST = "drop_oldest"  # Evict the oldest queued record, the upstream stage never waits
+
+DEFAULT_MAXSIZE = 8
+_STOP = object()
+
+
+class StageQueue:
+    """Bounded queue in front of a stage with a backpressure policy."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, policy=BLOCK):
+        if policy not in (BLOCK, DROP_OLDEST):
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.queue = asyncio.Queue(maxsize)
+        self.policy = policy
+        self.dropped = 0
+
+    async def put(self, item):
+        """Queue a record, evicting the oldest one first if the policy allows dropping."""
+        if item is not _STOP and self.policy == DROP_OLDEST and self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        await self.queue.put(item)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+
+class Stage:
+    """A blocking function run in a worker thread for every record that reaches it."""
+
+    def __init__(self, name, func, policy=BLOCK, maxsize=DEFAULT_MAXSIZE):
+        self.name = name
+        self.func = tracer.wrap(func, name, stage=name)
+        self.policy = policy
+        self.maxsize = maxsize
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.latencies = deque(maxlen=WINDOW)  # seconds per record, most recent
+        self.histogram = metrics.histogram("stage_seconds", "Time to process one record, per stage.",
+                                           stage=name)
+        self.processed_total = metrics.counter("stage_processed_total", "Records processed, per stage.",
+                                               stage=name)
+        self.errors_total = metrics.counter("stage_errors_total", "Records that failed, per stage.",
+                                            stage=name)
+
+
+class Orchestrator:
+    """Runs the acquisition sources every interval and feeds each record through the stages.
+
+    All sources of one cycle run concurrently (camera exposure overlaps LiDAR, ToF and IMU
+    reads) and their results are merged into a single record dict keyed by source name.
+    Stages are chained: a stage returns the record to pass it on, or None to stop it there.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.sources = {}
+        self.stages = []
+        self.queues = []
+        self.cycles = 0
+        self.source_runs = {}   # name -> times run
+        self.source_times = {}  # name -> recent run times (s)
+        self.source_histograms = {}
+        self.cycles_total = metrics.counter("cycles_total", "Capture cycles started.")
+
+    def add_source(self, name, func):
+        """Register a blocking callable whose result is stored in the record under name."""
+        # Traced where it runs, so each span is on the worker thread that did the work
+        self.sources[name] = tracer.wrap(func, name, source=name)
+        self.source_runs[name] = 0
+        self.source_times[name] = deque(maxlen=WINDOW)
+        self.source_histograms[name] = metrics.histogram(
+            "source_seconds", "Time to acquire one sample, per capture source.", source=name)
+
+    def _timed(self, name):
+        """Run a source and record how long it took, failures included."""
+        started = time.perf_counter()
+        try:
+            return self.sources[name]()
+        finally:
+            elapsed = time.perf_counter() - started
+            self.source_times[name].append(elapsed)
+            self.source_histograms[name].observe(elapsed)
+            self.source_runs[name] += 1
+
+    def add_stage(self, name, func, policy=BLOCK, maxsize=DEFAULT_MAXSIZE):
+        """Append a stage to the end of the chain."""
+        self.stages.append(Stage(name, func, policy, maxsize))
+
+    async def _acquire(self):
+        """Run every source concurrently and merge the results into one record."""
+        names = list(self.sources)
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._timed, name) for name in names),
+            return_exceptions=True)
+        record = {"cycle": self.cycles, "acquired_at": time.time()}
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                print(f"Source {name} failed: {result}")
+                result = None
+            record[name] = result
+        return record
+
+    async def _produce(self, cycles):
+        """Start a new acquisition cycle on a fixed schedule until cycles have run."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while cycles is None or self.cycles < cycles:
+            record = await self._acquire()
+            self.cycles += 1
+            self.cycles_total.inc()
+            if self.queues:
+                await self.queues[0].put(record)
+            # Schedule against the start time so slow cycles do not accumulate drift
+            next_start = start + self.cycles * self.interval
+            delay = next_start - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if self.queues:
+            await self.queues[0].put(_STOP)
+
+    async def _consume(self, index):
+        """Pull records for one stage and hand the survivors to the next queue."""
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        while True:
+            record = await inbox.get()
+            if record is _STOP:
+                break
+            started = time.perf_counter()
+            try:
+                record = await asyncio.to_thread(stage.func, record)
+            except Exception as e:
+                stage.errors += 1
+                stage.errors_total.inc()
+                print(f"Stage {stage.name} failed: {str(e)}")
+                record = None
+            elapsed = time.perf_counter() - started
+            stage.busy_time += elapsed
+            stage.latencies.append(elapsed)
+            stage.histogram.observe(elapsed)
+            stage.processed += 1
+            stage.processed_total.inc()
+            if record is not None and outbox is not None:
+                await outbox.put(record)
+        if outbox is not None:
+            await outbox.put(_STOP)
+
+    async def run(self, cycles=None):
+        """Run the pipeline, forever if cycles is None, and drain every stage before returning."""
+        self.queues = [StageQueue(stage.maxsize, stage.policy) for stage in self.stages]
+        for stage, queue in zip(self.stages, self.queues):
+            metrics.gauge("queue_depth", "Records waiting in front of each stage.",
+                          function=queue.qsize, stage=stage.name)
+            metrics.counter("queue_dropped_total", "Records evicted from a full drop-oldest queue.",
+                            function=lambda queue=queue: queue.dropped, stage=stage.name)
+        consumers = [asyncio.create_task(self._consume(i)) for i in range(len(self.stages))]
+        try:
+            await self._produce(cycles)
+            await asyncio.gather(*consumers)
+        finally:
+            for task in consumers:
+                task.cancel()
+
+    def stats(self):
+        """Per-stage counters, queue depths, dropped records and latency percentiles (ms)."""
+        return {
+            stage.name: {
+                "processed": stage.processed,
+                "errors": stage.errors,
+                "busy_time": stage.busy_time,
+                "queued": queue.qsize(),
+                "dropped": queue.dropped,
+                **{f"{name}_ms": value * 1e3 for name, value in percentiles(stage.latencies).items()},
+            }
+            for stage, queue in zip(self.stages, self.queues)
+        }
+
+    def source_stats(self):
+        """Run count and latency percentiles (ms) of every source."""
+        return {
+            name: {"count": self.source_runs[name],
+                   **{f"{key}_ms": value * 1e3 for key, value in percentiles(times).items()}}
+            for name, times in self.source_times.items()
+        }
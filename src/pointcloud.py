@@ -0,0 +1,125 @@
+"""Compact point-cloud container backed by one contiguous structured NumPy array."""
+
+import numpy as np
+
+# 21 bytes per point (packed), against 100+ for a Python tuple of three floats
+POINT_DTYPE = np.dtype([
+    ("xyz", "<f4", (3,)),   # position, same units as the LiDAR distance
+    ("quality", "u1"),      # RPLidar return quality
+    ("t_offset", "<f4"),    # seconds relative to the cloud's timestamp
+    ("scan_id", "<u4"),     # scan the point came from
+])
+CHUNK = 4096  # points added per growth step at minimum
+
+
+class PointCloud:
+    """Growable array of points; slices and field accessors are views, not copies."""
+
+    def __init__(self, capacity=CHUNK, timestamp=None):
+        self._data = np.empty(capacity, dtype=POINT_DTYPE)
+        self._count = 0
+        self.timestamp = timestamp  # monotonic ns stamp the t_offset values are relative to
+
+    @classmethod
+    def from_array(cls, points, timestamp=None):
+        """Wrap an existing POINT_DTYPE array without copying it."""
+        cloud = cls.__new__(cls)
+        cloud._data = points
+        cloud._count = len(points)
+        cloud.timestamp = timestamp
+        return cloud
+
+    @classmethod
+    def from_bytes(cls, buffer, timestamp=None):
+        """Zero-copy view over bytes produced by tobytes() (read-only if buffer is)."""
+        return cls.from_array(np.frombuffer(buffer, dtype=POINT_DTYPE), timestamp)
+
+    def _reserve(self, extra):
+        needed = self._count + extra
+        if needed <= len(self._data):
+            return
+        # Grow by at least one chunk and by half the current size, so long sessions
+        # do not copy the whole cloud on every append
+        capacity = max(needed, len(self._data) + CHUNK, len(self._data) * 3 // 2)
+        data = np.empty(capacity, dtype=POINT_DTYPE)
+        data[:self._count] = self._data[:self._count]
+        self._data = data
+
+    def append(self, xyz, quality=0, t_offset=0.0, scan_id=0):
+        """Append an (N, 3) block of points; the other fields may be scalars or length-N arrays."""
+        xyz = np.asarray(xyz, dtype=np.float32).reshape(-1, 3)
+        n = len(xyz)
+        self._reserve(n)
+        block = self._data[self._count:self._count + n]
+        block["xyz"] = xyz
+        block["quality"] = quality
+        block["t_offset"] = t_offset
+        block["scan_id"] = scan_id
+        self._count += n
+        return block
+
+    def extend(self, other):
+        """Append every point of another PointCloud."""
+        n = len(other)
+        self._reserve(n)
+        self._data[self._count:self._count + n] = other.points
+        self._count += n
+
+    def clear(self):
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        """Slices return a PointCloud view; integer and mask indexing follow NumPy rules."""
+        points = self.points[index]
+        if isinstance(index, slice):
+            return PointCloud.from_array(points, self.timestamp)
+        return points
+
+    @property
+    def points(self):
+        """Structured view of the stored points."""
+        return self._data[:self._count]
+
+    @property
+    def xyz(self):
+        """(N, 3) float32 view of the positions."""
+        return self._data["xyz"][:self._count]
+
+    @property
+    def quality(self):
+        return self._data["quality"][:self._count]
+
+    @property
+    def t_offset(self):
+        return self._data["t_offset"][:self._count]
+
+    @property
+    def scan_id(self):
+        return self._data["scan_id"][:self._count]
+
+    def columns(self):
+        """x, y and z as separate views, ready for ax.scatter(xs, ys, zs)."""
+        xyz = self.xyz
+        return xyz[:, 0], xyz[:, 1], xyz[:, 2]
+
+    @property
+    def nbytes(self):
+        return self._count * POINT_DTYPE.itemsize
+
+    def memoryview(self):
+        """Buffer over the stored points for uploads and file writes, without copying."""
+        return memoryview(self.points).cast("B")
+
+    def tobytes(self):
+        return self.points.tobytes()
+
+    def to_list(self):
+        """Positions as a list of [x, y, z] lists for JSON consumers."""
+        return self.xyz.tolist()
+
+    def shrink(self):
+        """Release unused capacity."""
+        self._data = self._data[:self._count].copy()
@@ -0,0 +1,119 @@
+"""Point-cloud rendering in a separate process so plotting never blocks acquisition.
+
+Matplotlib is only imported inside the rendering process; the capture process just
+decimates each cloud and offers it to a small queue, dropping frames the renderer
+has not caught up with.
+"""
+
+import multiprocessing
+import os
+import queue
+
+import numpy as np
+
+MAX_POINTS = 20000  # points drawn per frame after decimation
+QUEUE_SIZE = 2      # frames waiting for the renderer before new ones are dropped
+LIVE = "live"
+SNAPSHOTS = "snapshots"
+
+
+def decimate(xyz, max_points=MAX_POINTS):
+    """Keep at most max_points by taking every k-th point (stable between frames)."""
+    xyz = np.asarray(xyz, dtype=np.float32)
+    if len(xyz) <= max_points:
+        return xyz
+    step = -(-len(xyz) // max_points)
+    return xyz[::step]
+
+
+def _latest(frames, block_timeout):
+    """Wait for a frame, then skip ahead to the newest one queued.
+
+    Returns (frame, stop); frame is None if only the stop sentinel was queued.
+    """
+    frame = frames.get(timeout=block_timeout)
+    while frame is not None:
+        try:
+            newer = frames.get_nowait()
+        except queue.Empty:
+            return frame, False
+        if newer is None:
+            return frame, True
+        frame = newer
+    return None, True
+
+
+def _draw(ax, xyz):
+    ax.cla()
+    if len(xyz):
+        ax.scatter(xyz[:, 0], xyz[:, 1], xyz[:, 2], s=1)
+    ax.set_xlabel('X (cm)')
+    ax.set_ylabel('Y (cm)')
+    ax.set_zlabel('Z (cm)')
+
+
+def _render_loop(frames, mode, output_dir):
+    """Body of the rendering process."""
+    import matplotlib
+    if mode == SNAPSHOTS:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection='3d')
+    if mode == LIVE:
+        plt.ion()
+        plt.show()
+    count = 0
+    while True:
+        try:
+            frame, stop = _latest(frames, 0.1)
+        except queue.Empty:
+            if mode == LIVE:
+                plt.pause(0.05)  # keep the window responsive between frames
+            continue
+        if frame is not None:
+            _draw(ax, frame)
+            if mode == LIVE:
+                plt.pause(0.001)
+            else:
+                count += 1
+                fig.savefig(os.path.join(output_dir, f"cloud_{count:06d}.png"), dpi=100)
+        if stop:
+            break
+    plt.close(fig)
+
+
+class Renderer:
+    """Owns the rendering process; submit() never waits on it."""
+
+    def __init__(self, mode=LIVE, output_dir=None, max_points=MAX_POINTS):
+        if mode == SNAPSHOTS:
+            output_dir = output_dir or os.getcwd()
+            os.makedirs(output_dir, exist_ok=True)
+        self.max_points = max_points
+        self.dropped = 0
+        # fork keeps the child from re-running the capture script's module-level setup
+        context = multiprocessing.get_context("fork")
+        self.frames = context.Queue(QUEUE_SIZE)
+        self.process = context.Process(target=_render_loop, args=(self.frames, mode, output_dir),
+                                       name="renderer", daemon=True)
+        self.process.start()
+
+    def submit(self, xyz):
+        """Offer a cloud to the renderer; returns False if it was dropped."""
+        try:
+            self.frames.put_nowait(decimate(xyz, self.max_points))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout=2.0):
+        try:
+            self.frames.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,267 @@
+"""ICP scan matching between consecutive RPLidar scans, for heading and translation.
+
+Scans are matched in the LiDAR plane. Each iteration pairs every point of the new scan
+with its nearest neighbour in the previous one (a spatial_index.KDTree built once per
+reference scan), drops pairs that are too far apart or in the worst tail, and solves
+the alignment in closed form: an SVD (Kabsch) fit for point-to-point, or one
+linearized least-squares step for point-to-line, using normals taken from the
+reference scan's angular order. Matching is seeded with the IMU yaw change.
+
+A match maps the new scan into the frame of the previous one: p_prev = R p_new + t.
+"""
+
+import threading
+from collections import deque, namedtuple
+
+import numpy as np
+
+from spatial_index import KDTree
+from transform import scan_to_3D, scan_to_arrays
+
+POINT_TO_POINT = "point"
+POINT_TO_LINE = "line"
+MAX_ITERATIONS = 30
+TOLERANCE = 1e-4        # stop when an update turns less than this (rad) and moves less (m)
+MAX_DISTANCE = 300.0    # pairs further apart than this (mm) are not correspondences
+TRIM = 0.9              # fraction of the closest pairs used in each fit
+MIN_POINTS = 20         # fewer valid returns than this and a scan is not matched
+MAX_POINTS = 500        # larger scans are decimated for matching
+MAX_RESIDUAL = 100.0    # RMS fit error (mm) above which a match is not trusted
+HISTORY = 64            # poses kept for pose_at() and pose_near()
+
+Match = namedtuple("Match", ["yaw", "translation", "residual", "inliers", "iterations", "converged"])
+Pose = namedtuple("Pose", ["timestamp", "x", "y", "heading", "match"])
+
+
+def rotation(theta):
+    c, s = np.cos(theta), np.sin(theta)
+    return np.array([[c, -s], [s, c]])
+
+
+def scan_points(angles, distances, qualities=None, min_quality=0, table=None):
+    """(N, 2) float64 points of a scan in its own frame, in angular order."""
+    order = np.argsort(angles, kind="stable")
+    angles, distances = np.asarray(angles)[order], np.asarray(distances)[order]
+    qualities = None if qualities is None else np.asarray(qualities)[order]
+    points = scan_to_3D(angles, distances, qualities, min_quality=min_quality, table=table)
+    return points[np.isfinite(points).all(axis=1), :2].astype(np.float64)
+
+
+def line_normals(points, max_gap=MAX_DISTANCE):
+    """Unit normals of the surface through each point from its angular neighbours.
+
+    Points whose neighbours are further than max_gap away (scan edges, depth jumps) get
+    a zero normal, which removes them from point-to-line fits.
+    """
+    before = np.roll(points, 1, axis=0)
+    after = np.roll(points, -1, axis=0)
+    tangent = after - before
+    length = np.hypot(tangent[:, 0], tangent[:, 1])
+    usable = ((np.hypot(*(points - before).T) < max_gap)
+              & (np.hypot(*(after - points).T) < max_gap) & (length > 0))
+    normals = np.zeros_like(points)
+    normals[usable] = np.column_stack((-tangent[usable, 1], tangent[usable, 0])) / length[usable, None]
+    return normals
+
+
+def fit_point_to_point(source, target):
+    """Closed-form rigid (R, t) minimizing |R source + t - target|^2 (Kabsch, via SVD)."""
+    source_mean = source.mean(axis=0)
+    target_mean = target.mean(axis=0)
+    covariance = (source - source_mean).T @ (target - target_mean)
+    u, _, vt = np.linalg.svd(covariance)
+    d = np.sign(np.linalg.det(vt.T @ u.T))  # guard against a reflection
+    r = vt.T @ np.diag([1.0, d]) @ u.T
+    return np.arctan2(r[1, 0], r[0, 0]), target_mean - r @ source_mean
+
+
+def fit_point_to_line(source, target, normals):
+    """Small-angle (theta, t) minimizing sum((n . (R source + t - target))^2)."""
+    # r_i = n . (p - q) + theta * n . (J p) + n . t, with J the 90 degree rotation
+    a = np.column_stack((normals[:, 1] * source[:, 0] - normals[:, 0] * source[:, 1],
+                         normals[:, 0], normals[:, 1]))
+    b = -np.einsum("ij,ij->i", normals, source - target)
+    solution, *_ = np.linalg.lstsq(a, b, rcond=None)
+    return solution[0], solution[1:]
+
+
+def icp(source, target, initial_yaw=0.0, initial_translation=(0.0, 0.0), method=POINT_TO_LINE,
+        tree=None, normals=None, max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE,
+        max_distance=MAX_DISTANCE, trim=TRIM):
+    """Align (N, 2) source points to (M, 2) target points; yaws are in degrees.
+
+    tree (a KDTree of target with z = 0) and normals (line_normals of target) can be
+    passed in when the same target is matched more than once.
+    """
+    if tree is None:
+        tree = KDTree(np.column_stack((target, np.zeros(len(target)))))
+    if method == POINT_TO_LINE and normals is None:
+        normals = line_normals(target)
+    theta = np.radians(initial_yaw)
+    t = np.asarray(initial_translation, dtype=np.float64)
+    lifted = np.zeros((len(source), 3))
+    residual, inliers, converged = np.inf, 0.0, False
+    for iteration in range(1, max_iterations + 1):
+        moved = source @ rotation(theta).T + t
+        lifted[:, :2] = moved
+        distance, nearest = tree.query(lifted, 1)
+        distance, nearest = distance[:, 0], nearest[:, 0]
+        close = distance <= max_distance
+        if close.sum() < MIN_POINTS:
+            break
+        # Trim the worst pairs, which are mostly points seen in only one of the scans
+        keep = np.flatnonzero(close)
+        keep = keep[distance[keep] <= np.quantile(distance[keep], trim)]
+        if method == POINT_TO_LINE:
+            keep = keep[normals[nearest[keep]].any(axis=1)]
+            if len(keep) < MIN_POINTS:
+                break
+            step, shift = fit_point_to_line(moved[keep], target[nearest[keep]], normals[nearest[keep]])
+        else:
+            step, shift = fit_point_to_point(moved[keep], target[nearest[keep]])
+        # Compose the update with the current estimate
+        theta += step
+        t = rotation(step) @ t + shift
+        residual = float(np.sqrt(np.mean(distance[keep] ** 2)))
+        inliers = len(keep) / len(source)
+        if abs(step) < tolerance and np.hypot(*shift) / 1000.0 < tolerance:
+            converged = True
+            break
+    return Match(float(np.degrees(theta)), t, residual, inliers, iteration, converged)
+
+
+class ScanMatcher:
+    """Integrates scan-to-scan matches into a planar pose (mm, degrees).
+
+    Called once per scan, e.g. as the LidarReader callback. When a match fails or fits
+    badly the IMU yaw change is used alone and the translation is assumed zero.
+    """
+
+    def __init__(self, orientation, method=POINT_TO_LINE, table=None, max_points=MAX_POINTS):
+        self.orientation = orientation  # returns the current IMU yaw in degrees
+        self.method = method
+        self.table = table
+        self.max_points = max_points
+        self.lock = threading.Lock()
+        self.poses = deque(maxlen=HISTORY)
+        self.previous = None  # (points, tree, normals, yaw) of the last scan
+        self.matched = 0
+        self.failed = 0
+
+    def __call__(self, timestamp, scan):
+        self.update(timestamp, scan)
+
+    def update(self, timestamp, scan):
+        """Match a raw RPLidar scan against the previous one and return its Pose."""
+        yaw = self.orientation()
+        angles, distances, qualities = scan_to_arrays(scan)
+        points = scan_points(angles, distances, qualities, table=self.table)
+        if len(points) > self.max_points:
+            points = points[::-(-len(points) // self.max_points)]
+        if len(points) < MIN_POINTS:
+            return None
+
+        tree = KDTree(np.column_stack((points, np.zeros(len(points)))))
+        normals = line_normals(points) if self.method == POINT_TO_LINE else None
+        match = None
+        if self.previous is None:
+            x, y, heading = 0.0, 0.0, yaw
+        else:
+            previous_points, previous_tree, previous_normals, previous_yaw = self.previous
+            # The IMU heading wraps at 360 degrees, the change between rotations does not
+            imu_change = (yaw - previous_yaw + 180.0) % 360.0 - 180.0
+            match = icp(points, previous_points, imu_change, method=self.method,
+                        tree=previous_tree, normals=previous_normals)
+            last = self.poses[-1]
+            if match.converged and match.residual <= MAX_RESIDUAL:
+                self.matched += 1
+                yaw_change, translation = match.yaw, match.translation
+            else:
+                self.failed += 1
+                yaw_change, translation = imu_change, np.zeros(2)
+            dx, dy = rotation(np.radians(last.heading)) @ translation
+            x, y, heading = last.x + dx, last.y + dy, last.heading + yaw_change
+        self.previous = (points, tree, normals, yaw)
+        pose = Pose(timestamp, x, y, heading, match)
+        with self.lock:
+            self.poses.append(pose)
+        return pose
+
+    def latest(self):
+        with self.lock:
+            return self.poses[-1] if self.poses else None
+
+    def pose_at(self, timestamp):
+        """Pose of the scan stamped timestamp, or the newest pose if it is no longer kept."""
+        with self.lock:
+            for pose in reversed(self.poses):
+                if pose.timestamp == timestamp:
+                    return pose
+            return self.poses[-1] if self.poses else None
+
+    def pose_near(self, timestamp):
+        """Pose of the kept scan stamped closest to timestamp, e.g. another sensor's reading."""
+        with self.lock:
+            if not self.poses:
+                return None
+            return min(self.poses, key=lambda pose: abs(pose.timestamp - timestamp))
+
+
+if __name__ == '__main__':
+    # Simulate the A1M8 in a walled plot with shrubs and time matching between scans
+    import time
+
+    rng = np.random.default_rng(6)
+    walls = [((-4000, -3000), (5000, -3000)), ((5000, -3000), (5000, 4000)),
+             ((5000, 4000), (-4000, 4000)), ((-4000, 4000), (-4000, -3000))]
+    shrubs = [(np.array(centre), radius) for centre, radius in
+              [((1500, 800), 400), ((-2000, -1200), 600), ((2500, -1800), 300), ((-1000, 2500), 500)]]
+
+    def simulate(x, y, heading, beams=360, noise=10.0):
+        """Ray-cast a scan from a pose (mm, degrees) into (angle, distance) returns."""
+        angles = np.sort(rng.uniform(0, 360, beams))
+        directions = np.column_stack((np.cos(np.radians(angles + heading)),
+                                      np.sin(np.radians(angles + heading))))
+        origin = np.array([x, y])
+        best = np.full(beams, np.inf)
+        for start, end in walls:
+            start, end = np.array(start, float), np.array(end, float)
+            edge = end - start
+            denominator = directions[:, 0] * edge[1] - directions[:, 1] * edge[0]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                offset = start - origin
+                hit = (offset[0] * edge[1] - offset[1] * edge[0]) / denominator
+                along = (offset[0] * directions[:, 1] - offset[1] * directions[:, 0]) / denominator
+            ok = (hit > 0) & (along >= 0) & (along <= 1)
+            best[ok] = np.minimum(best[ok], hit[ok])
+        for centre, radius in shrubs:
+            offset = centre - origin
+            projection = directions @ offset
+            miss = projection ** 2 - (offset @ offset - radius ** 2)
+            ok = (miss >= 0) & (projection > 0)
+            best[ok] = np.minimum(best[ok], projection[ok] - np.sqrt(miss[ok]))
+        return angles, best + rng.normal(0, noise, beams)
+
+    for method in (POINT_TO_POINT, POINT_TO_LINE):
+        truth = [0.0, 0.0, 0.0]
+        previous = simulate(*truth)
+        times, errors = [], []
+        for _ in range(50):
+            # Walking pace: up to ~0.3 m and 10 degrees between rotations
+            step = np.array([rng.uniform(-200, 300), rng.uniform(-150, 150), rng.uniform(-10, 10)])
+            moved = [truth[0] + step[0], truth[1] + step[1], truth[2] + step[2]]
+            scan = simulate(*moved)
+            source = scan_points(*scan)
+            target = scan_points(*previous)
+            imu_yaw = step[2] + rng.normal(0, 1.0)  # IMU seed with a degree of error
+            started = time.perf_counter()
+            match = icp(source, target, imu_yaw, method=method)
+            times.append(time.perf_counter() - started)
+            # Expected: the new pose expressed in the previous scan's frame
+            expected = rotation(np.radians(-truth[2])) @ (np.array(moved[:2]) - truth[:2])
+            errors.append((abs(match.yaw - step[2]), np.hypot(*(match.translation - expected))))
+            truth, previous = moved, scan
+        errors = np.array(errors)
+        print(f"point-to-{method}: "
+              f"median {np.median(times) * 1e3:.1f} ms per match (max {max(times) * 1e3:.1f} ms), "
+              f"median error {np.median(errors[:, 0]):.2f} deg / {np.median(errors[:, 1]):.1f} mm")
@@ -0,0 +1,209 @@
+"""Multi-rate sensor scheduler: every polled sensor on its own thread, at its own rate.
+
+Each task runs against a drift-free deadline clock: deadline n is start + n * period,
+counted from the task's start rather than from the previous wake-up, so wake-up jitter
+and slow calls never shift the deadlines after them. A call that overruns skips the
+deadlines that passed while it ran (they are counted as missed, not run back to back
+to catch up) and the task resumes on its schedule. Runs, misses, errors and wake-up
+lateness are reported per task in the metrics registry and by stats().
+
+High-rate samples go into a StreamBuffer, a fixed-size ring of timestamped rows that
+captures read without holding up the producer: latest() for the newest row, at() for
+the row linearly interpolated at any monotonic ns stamp inside the buffered window.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from clock import LatencyStats
+from metrics import metrics
+from tracing import tracer
+
+CAPACITY = 1024  # rows kept per stream, about 10 s of a 100 Hz sensor
+
+
+class PeriodicTask(threading.Thread):
+    """Calls func every 1 / rate seconds on its own thread, on a drift-free schedule."""
+
+    def __init__(self, name, func, rate):
+        super().__init__(name=name, daemon=True)
+        self.func = tracer.wrap(func, name, task=name)
+        self.rate = rate
+        self.period = int(round(1e9 / rate))  # ns
+        self.stopping = threading.Event()
+        self.runs = 0
+        self.missed = 0
+        self.errors = 0
+        # Wake-up lateness against each deadline, i.e. scheduling jitter
+        self.lateness = LatencyStats(histogram=metrics.histogram(
+            "scheduler_lateness_seconds", "Delay of each task run past its deadline.", task=name))
+        self._missed = metrics.counter("scheduler_missed_deadlines_total",
+                                       "Deadlines skipped because a run overran, per task.", task=name)
+        metrics.counter("scheduler_runs_total", "Task runs, per task.",
+                        function=lambda: self.runs, task=name)
+        metrics.counter("scheduler_errors_total", "Task runs that raised, per task.",
+                        function=lambda: self.errors, task=name)
+
+    def run(self):
+        start = time.monotonic_ns()
+        cycle = 0
+        while not self.stopping.is_set():
+            deadline = start + cycle * self.period
+            delay = deadline - time.monotonic_ns()
+            if delay > 0 and self.stopping.wait(delay / 1e9):
+                break
+            self.lateness.add(max(time.monotonic_ns() - deadline, 0))
+            try:
+                self.func()
+            except Exception as e:
+                self.errors += 1
+                print(f"{self.name} task error: {str(e)}")
+            self.runs += 1
+            # The next deadline still ahead; any passed while func ran are missed
+            upcoming = max(cycle + 1, (time.monotonic_ns() - start) // self.period + 1)
+            missed = upcoming - cycle - 1
+            if missed:
+                self.missed += missed
+                self._missed.inc(missed)
+            cycle = upcoming
+
+    def stats(self):
+        return {"rate_hz": self.rate, "runs": self.runs, "missed": self.missed,
+                "errors": self.errors, "lateness": self.lateness.as_dict()}
+
+    def stop(self):
+        self.stopping.set()
+        if self.is_alive():
+            self.join(timeout=1.0)
+
+
+class Scheduler:
+    """A set of PeriodicTasks started and stopped together."""
+
+    def __init__(self):
+        self.tasks = {}
+
+    def add(self, name, func, rate):
+        """Schedule func at rate Hz; returns its PeriodicTask."""
+        if name in self.tasks:
+            raise ValueError(f"Task {name} is already scheduled")
+        task = self.tasks[name] = PeriodicTask(name, func, rate)
+        return task
+
+    def start(self):
+        for task in self.tasks.values():
+            task.start()
+
+    def stop(self):
+        # Signal every task before waiting on any, so they wind down together
+        for task in self.tasks.values():
+            task.stopping.set()
+        for task in self.tasks.values():
+            task.stop()
+
+    def stats(self):
+        """Runs, misses, errors and lateness of every task."""
+        return {name: task.stats() for name, task in self.tasks.items()}
+
+
+class StreamBuffer:
+    """Ring buffer of (monotonic ns, row of width floats) samples from one sensor stream.
+
+    angles lists the columns holding angles in degrees, which are interpolated along the
+    shorter arc and returned in [0, 360).
+    """
+
+    def __init__(self, width, capacity=CAPACITY, angles=()):
+        self.capacity = capacity
+        self.angles = list(angles)
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.rows = np.zeros((capacity, width))
+        self.count = 0
+        self.lock = threading.Lock()
+        self.appended = threading.Condition(self.lock)
+
+    def append(self, timestamp, row):
+        with self.appended:
+            slot = self.count % self.capacity
+            self.times[slot] = timestamp
+            self.rows[slot] = row
+            self.count += 1
+            self.appended.notify_all()
+
+    def latest(self):
+        """Return (timestamp, row) of the newest sample, or None while empty."""
+        with self.lock:
+            if not self.count:
+                return None
+            slot = (self.count - 1) % self.capacity
+            return int(self.times[slot]), self.rows[slot].copy()
+
+    def wait_for(self, timestamp, timeout=None):
+        """Wait until a sample at or after timestamp is buffered; False on timeout."""
+        def arrived():
+            return self.count and self.times[(self.count - 1) % self.capacity] >= timestamp
+        with self.appended:
+            return bool(self.appended.wait_for(arrived, timeout))
+
+    def at(self, timestamp):
+        """Return (timestamp, row) interpolated at a monotonic ns stamp, or None while empty.
+
+        Outside the buffered window the oldest or newest sample is returned as it is,
+        with its own timestamp.
+        """
+        with self.lock:
+            if not self.count:
+                return None
+            # Slots oldest first, unrolling the ring once it has wrapped
+            order = np.arange(max(self.count - self.capacity, 0), self.count) % self.capacity
+            times = self.times[order]
+            after = int(np.searchsorted(times, timestamp, side="right"))
+            if after == 0 or times[after - 1] == timestamp:
+                slot = order[max(after - 1, 0)]
+                return int(self.times[slot]), self.rows[slot].copy()
+            if after == len(order):
+                return int(times[-1]), self.rows[order[-1]].copy()
+            first, second = self.rows[order[after - 1]], self.rows[order[after]]
+            fraction = (timestamp - times[after - 1]) / (times[after] - times[after - 1])
+            row = first + fraction * (second - first)
+            if self.angles:
+                change = (second[self.angles] - first[self.angles] + 180.0) % 360.0 - 180.0
+                row[self.angles] = (first[self.angles] + fraction * change) % 360.0
+        return timestamp, row
+
+
+if __name__ == '__main__':
+    # Schedule a fast and a slow task side by side, then check the schedule did not drift,
+    # that overruns are counted as misses and that streams interpolate between samples
+    duration = 2.0
+    stream = StreamBuffer(2, angles=[1])
+
+    def sample():
+        now = time.monotonic_ns()
+        stream.append(now, [now / 1e9, (now / 1e9 * 90.0) % 360.0])  # heading turns 90 deg/s
+
+    def slow():
+        time.sleep(0.025)  # overruns its 20 ms period every time
+
+    scheduler = Scheduler()
+    fast = scheduler.add("sample", sample, 200.0)
+    overrun = scheduler.add("slow", slow, 50.0)
+    scheduler.start()
+    time.sleep(duration)
+    scheduler.stop()
+    for name, stats in scheduler.stats().items():
+        print(f"{name}: {stats['runs']} runs at {stats['rate_hz']:g} Hz, {stats['missed']} missed, "
+              f"lateness p50 {stats['lateness']['p50_ms']:.3f} ms p99 {stats['lateness']['p99_ms']:.3f} ms")
+    # Drift-free: every deadline in the run is either met or counted as missed
+    assert abs(fast.runs + fast.missed - duration * fast.rate) <= 3, fast.stats()
+    # Each 25 ms run ends past the next deadline, so every other deadline is skipped
+    assert overrun.missed >= overrun.runs - 2 and overrun.runs <= duration * overrun.rate / 2 + 2
+
+    (first, _), (last, _) = stream.at(0), stream.latest()
+    middle = (first + last) // 2
+    _, row = stream.at(middle)
+    assert abs(row[0] - middle / 1e9) < 1e-6 and abs(row[1] - (middle / 1e9 * 90.0) % 360.0) < 1e-6
+    assert stream.at(last + 10 ** 9)[0] == last
+    print(f"interpolated {stream.count} samples to within 1e-6")
@@ -0,0 +1,277 @@
+"""Append-only, chunked binary session log for offline capture.
+
+File layout (little endian):
+    file header   magic "WBSLOG01", creation wall time (ns)
+    chunk         magic "CHNK", index, record count, payload length, payload CRC32,
+                  lowest and highest record stamps, then the payload of packed records
+    record        type (u8), monotonic stamp (ns), data length (u32), data
+    footer index  one (offset, lowest stamp, highest stamp, record count) entry per chunk
+    trailer       index offset, entry count, index CRC32, magic "WBSEND01"
+
+Chunks are written whole, so a crash loses at most the unwritten tail. A file without
+a valid trailer is recovered by scanning chunks until the first bad CRC.
+
+Records are not written in stamp order (an image is logged once its capture ends, a
+scan is stamped when its rotation completes), so each chunk is indexed by the range
+of stamps it holds rather than by its first and last record.
+"""
+
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+FILE_MAGIC = b"WBSLOG01"
+CHUNK_MAGIC = b"CHNK"
+END_MAGIC = b"WBSEND01"
+
+FILE_HEADER = struct.Struct("<8sq")
+CHUNK_HEADER = struct.Struct("<4sIIIIqq")
+RECORD_HEADER = struct.Struct("<BqI")
+INDEX_ENTRY = struct.Struct("<Qqqi")
+TRAILER = struct.Struct("<QII8s")
+STATE_HEADER = struct.Struct("<BH")
+
+# Record types
+RECORD_IMU = 1      # raw 45-byte BNO055 register block, decode with imu.decode
+RECORD_TOF = 2      # float32 distance (cm)
+RECORD_LIDAR = 3    # float32 (N, 3) array of angle, distance, quality
+RECORD_IMAGE = 4    # UTF-8 image path
+RECORD_JSON = 5     # UTF-8 JSON document, e.g. a capture record
+RECORD_STATE = 6    # smoothed state: source type (u8), channel count (u16), float32 values then rates
+
+CHUNK_SIZE = 64 * 1024   # payload bytes per chunk before it is written out
+FSYNC_INTERVAL = 2.0     # seconds between group commits
+QUEUE_SIZE = 10000       # records buffered for the writer thread
+
+
+class SessionWriter:
+    """Buffers typed records into chunks on a background thread; append never blocks by default."""
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, fsync_interval=FSYNC_INTERVAL,
+                 maxsize=QUEUE_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.fsync_interval = fsync_interval
+        self.pending = queue.Queue(maxsize)
+        self.dropped = 0
+        self.index = []
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.file = open(path, "r+b")
+            self._reopen()
+        else:
+            self.file = open(path, "wb")
+            self.file.write(FILE_HEADER.pack(FILE_MAGIC, time.time_ns()))
+
+        self.payload = bytearray()
+        self.count = 0
+        self.lowest = self.highest = None
+        self.last_sync = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self.thread.start()
+
+    def _reopen(self):
+        """Continue an existing session: drop its footer (or corrupt tail) and keep appending."""
+        self.index, end = read_index(self.file)
+        self.file.seek(end)
+        self.file.truncate()
+        if not end:
+            # Cut off inside the file header: start the session over
+            self.file.write(FILE_HEADER.pack(FILE_MAGIC, time.time_ns()))
+
+    def append(self, record_type, timestamp, data, block=False):
+        """Queue one record; returns False (and counts a drop) if the writer has fallen behind.
+
+        Offline tools that must not lose records pass block=True to wait for room instead.
+        """
+        try:
+            self.pending.put((record_type, timestamp, bytes(data)), block=block)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def log_imu(self, timestamp, block):
+        return self.append(RECORD_IMU, timestamp, block)
+
+    def log_tof(self, timestamp, distance):
+        return self.append(RECORD_TOF, timestamp, struct.pack("<f", distance))
+
+    def log_scan(self, timestamp, angles, distances, qualities):
+        scan = np.column_stack((angles, distances, qualities)).astype("<f4")
+        return self.append(RECORD_LIDAR, timestamp, scan.tobytes())
+
+    def log_image(self, timestamp, image_path):
+        return self.append(RECORD_IMAGE, timestamp, image_path.encode("utf-8"))
+
+    def log_json(self, timestamp, document):
+        return self.append(RECORD_JSON, timestamp, json.dumps(document, default=str).encode("utf-8"))
+
+    def log_states(self, timestamps, source, values, rates):
+        """Append one RECORD_STATE per timestamp from (T, C) value and rate arrays, waiting for room."""
+        values = np.asarray(values, dtype="<f4")
+        header = np.frombuffer(STATE_HEADER.pack(source, values.shape[1]), dtype=np.uint8)
+        payloads = np.hstack((np.broadcast_to(header, (len(values), len(header))),
+                              values.view(np.uint8), np.asarray(rates, dtype="<f4").view(np.uint8)))
+        for timestamp, payload in zip(timestamps, payloads):
+            self.append(RECORD_STATE, int(timestamp), payload, block=True)
+
+    def _run(self):
+        while True:
+            try:
+                item = self.pending.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                item = None
+            if item is not None and item[0] is None:
+                break
+            if item is not None:
+                record_type, timestamp, data = item
+                self.payload += RECORD_HEADER.pack(record_type, timestamp, len(data))
+                self.payload += data
+                self.count += 1
+                if self.lowest is None:
+                    self.lowest = self.highest = timestamp
+                else:
+                    self.lowest = min(self.lowest, timestamp)
+                    self.highest = max(self.highest, timestamp)
+                if len(self.payload) >= self.chunk_size:
+                    self._write_chunk()
+            if time.monotonic() - self.last_sync >= self.fsync_interval:
+                # Group commit: write whatever is buffered and fsync once per interval
+                self._write_chunk()
+                self._sync()
+
+    def _write_chunk(self):
+        if not self.count:
+            return
+        offset = self.file.tell()
+        header = CHUNK_HEADER.pack(CHUNK_MAGIC, len(self.index), self.count, len(self.payload),
+                                   zlib.crc32(self.payload), self.lowest, self.highest)
+        self.file.write(header)
+        self.file.write(self.payload)
+        self.index.append((offset, self.lowest, self.highest, self.count))
+        self.payload = bytearray()
+        self.count = 0
+        self.lowest = self.highest = None
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        """Drain queued records, write the footer index and close the file."""
+        self.pending.put((None, 0, b""))
+        self.thread.join()
+        self._write_chunk()
+        index_offset = self.file.tell()
+        entries = b"".join(INDEX_ENTRY.pack(*entry) for entry in self.index)
+        self.file.write(entries)
+        self.file.write(TRAILER.pack(index_offset, len(self.index), zlib.crc32(entries), END_MAGIC))
+        self._sync()
+        self.file.close()
+
+
+def read_index(f):
+    """Return (chunk index, end of valid data) for an open session file.
+
+    Uses the footer when the trailer is intact, otherwise scans the chunks and stops at
+    the first truncated or corrupt one. A file cut off inside its header holds no
+    records: its index is empty and its valid data ends at 0.
+    """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    if size < FILE_HEADER.size:
+        if not FILE_MAGIC.startswith(f.read(len(FILE_MAGIC))):
+            raise ValueError(f"{getattr(f, 'name', f)} is not a session log")
+        return [], 0
+    magic, _ = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+    if magic != FILE_MAGIC:
+        raise ValueError(f"{getattr(f, 'name', f)} is not a session log")
+
+    if size >= FILE_HEADER.size + TRAILER.size:
+        f.seek(size - TRAILER.size)
+        index_offset, entries, crc, end = TRAILER.unpack(f.read(TRAILER.size))
+        if end == END_MAGIC and index_offset + entries * INDEX_ENTRY.size + TRAILER.size == size:
+            f.seek(index_offset)
+            raw = f.read(entries * INDEX_ENTRY.size)
+            if zlib.crc32(raw) == crc:
+                return [entry for entry in INDEX_ENTRY.iter_unpack(raw)], index_offset
+
+    index = []
+    offset = FILE_HEADER.size
+    while offset + CHUNK_HEADER.size <= size:
+        f.seek(offset)
+        magic, _, count, length, crc, lowest, highest = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+        if magic != CHUNK_MAGIC or zlib.crc32(f.read(length)) != crc:
+            break
+        index.append((offset, lowest, highest, count))
+        offset += CHUNK_HEADER.size + length
+    return index, offset
+
+
+class SessionReader:
+    """Reads records back, using the footer index to skip chunks outside a time window."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.index, _ = read_index(self.file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def records(self, types=None, start=None, end=None):
+        """Yield (type, timestamp, data) for records matching types and start <= stamp <= end."""
+        for offset, lowest, highest, _ in self.index:
+            if (start is not None and highest < start) or (end is not None and lowest > end):
+                continue
+            self.file.seek(offset)
+            header = CHUNK_HEADER.unpack(self.file.read(CHUNK_HEADER.size))
+            payload = self.file.read(header[3])
+            if zlib.crc32(payload) != header[4]:
+                raise ValueError(f"Corrupt chunk at offset {offset} in {self.path}")
+            position = 0
+            while position < len(payload):
+                record_type, timestamp, length = RECORD_HEADER.unpack_from(payload, position)
+                position += RECORD_HEADER.size
+                data = payload[position:position + length]
+                position += length
+                if types is not None and record_type not in types:
+                    continue
+                if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                    continue
+                yield record_type, timestamp, data
+
+
+def decode_record(record_type, data):
+    """Turn raw record data back into Python values."""
+    if record_type == RECORD_IMU:
+        from imu import decode
+        return decode(data)
+    if record_type == RECORD_TOF:
+        return struct.unpack("<f", data)[0]
+    if record_type == RECORD_LIDAR:
+        return np.frombuffer(data, dtype="<f4").reshape(-1, 3)
+    if record_type == RECORD_IMAGE:
+        return data.decode("utf-8")
+    if record_type == RECORD_JSON:
+        return json.loads(data)
+    if record_type == RECORD_STATE:
+        source, channels = STATE_HEADER.unpack_from(data)
+        state = np.frombuffer(data, dtype="<f4", offset=STATE_HEADER.size).reshape(2, channels)
+        return source, state[0], state[1]
+    return data
@@ -0,0 +1,431 @@
+"""Simulated sensors for running and load-testing the capture pipeline without the device.
+
+Drop-in fakes for the RPLidar, BNO055, VL53L4CD and camera drivers, all observing one
+synthetic forest-floor plot (trunks, shrubs and a fuel bed of varying depth) from a
+device walking a loop through it. Simulated time runs speed times faster than the wall
+clock: a LiDAR at 5.5 Hz simulated with speed 20 delivers 110 rotations a second, of a
+walk that moves 20 times faster, so the pipeline can be profiled and stress-tested at
+many times the real sensor rates on an ordinary Linux machine.
+
+Poses follow the pipeline's conventions: positions in mm, scan angles and the IMU
+heading in degrees counter-clockwise, so that scan_to_3D and ScanMatcher reproduce the
+simulated walk.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from camera import PLACEHOLDER_JPEG, FakeCamera
+from imu import DATA_LENGTH, SCALES
+from tof_reader import FakeTofSensor
+
+SPEED = 1.0             # simulated seconds per wall-clock second
+PLOT_SIZE = 30000.0     # edge of the square plot (mm)
+TRUNKS = 40
+SHRUBS = 80
+WALK_EXTENT = 5000.0    # the walk loops within +-this of the plot centre (mm)
+WALK_SPEED = 400.0      # peak walking speed (mm/s)
+LIDAR_HEIGHT = 1000.0   # LiDAR plane above the ground (mm)
+TOF_HEIGHT = 1000.0     # ToF mount height above the ground (mm)
+LIDAR_RATE = 5.5        # rotations per second, the A1M8 default
+LIDAR_SAMPLES = 360     # returns per rotation
+LIDAR_RANGE = 12000.0   # beyond this (mm) a beam returns nothing
+LIDAR_NOISE = 10.0      # range noise, standard deviation (mm)
+LIDAR_DROPOUT = 0.02    # fraction of beams with no return
+IMU_RATE = 100.0        # BNO055 fusion output rate (Hz)
+IMU_NOISE = 0.05        # accelerometer noise, standard deviation (m/s^2)
+TOF_BUDGET = 50         # VL53L4CD timing budget (ms)
+TOF_NOISE = 0.5         # standard deviation (cm)
+TOF_DROPOUT = 0.02      # fraction of readings with no target, reported as 0 cm
+CAPTURE_DELAY = 0.3     # seconds per still, exposure and encoding
+IMAGE_SIZE = (2328, 1748)  # IMX519 2x2 binned still
+GRAVITY = 9.80665
+
+
+class SimulatedTime:
+    """Simulated seconds since start, running speed times faster than time.monotonic()."""
+
+    def __init__(self, speed=SPEED):
+        self.speed = float(speed)
+        self.started = time.monotonic()
+
+    def now(self):
+        return (time.monotonic() - self.started) * self.speed
+
+    def sleep_until(self, t, event=None):
+        """Sleep until simulated time t; returns True early if event is set."""
+        delay = (t - self.now()) / self.speed
+        if delay <= 0:
+            return False
+        if event is not None:
+            return event.wait(delay)
+        time.sleep(delay)
+        return False
+
+
+class ForestScene:
+    """Trunks and shrubs as vertical cylinders over a smoothly varying fuel bed."""
+
+    def __init__(self, seed=0, size=PLOT_SIZE, trunks=TRUNKS, shrubs=SHRUBS):
+        rng = np.random.default_rng(seed)
+        half = size / 2
+        # (x, y, radius, height) per object, trunks taller than any sensor
+        self.objects = np.vstack((
+            np.column_stack((rng.uniform(-half, half, (trunks, 2)), rng.uniform(80, 300, trunks),
+                             np.full(trunks, np.inf))),
+            np.column_stack((rng.uniform(-half, half, (shrubs, 2)), rng.uniform(150, 700, shrubs),
+                             rng.uniform(300, 1800, shrubs))),
+        ))
+        # Fuel-bed depth as a sum of a few random plane waves, 0 to about 600 mm
+        self.waves = np.column_stack((rng.uniform(-1, 1, (6, 2)) / 1500.0, rng.uniform(0, 2 * np.pi, 6)))
+
+    def fuel_depth(self, x, y):
+        """Height (mm) of the top of the fuel bed or of a shrub, seen from above at (x, y)."""
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        phase = np.multiply.outer(x, self.waves[:, 0]) + np.multiply.outer(y, self.waves[:, 1])
+        depth = np.clip(300.0 + 60.0 * np.sin(phase + self.waves[:, 2]).sum(axis=-1), 0.0, None)
+        shrubs = self.objects[np.isfinite(self.objects[:, 3])]
+        inside = (np.hypot(np.subtract.outer(x, shrubs[:, 0]), np.subtract.outer(y, shrubs[:, 1]))
+                  <= shrubs[:, 2])
+        return np.maximum(depth, np.where(inside, shrubs[:, 3], 0.0).max(axis=-1))
+
+    def ray_cast(self, origins, directions, height, max_range=LIDAR_RANGE):
+        """Range (mm) along each (N, 2) ray to the first object taller than height, inf if none."""
+        objects = self.objects[self.objects[:, 3] > height]
+        offset = objects[None, :, :2] - origins[:, None, :]                  # (N, M, 2)
+        projection = np.einsum("nmk,nk->nm", offset, directions)
+        miss = projection ** 2 - ((offset ** 2).sum(axis=2) - objects[:, 2] ** 2)
+        with np.errstate(invalid="ignore"):
+            hit = projection - np.sqrt(miss)
+        hit[(miss < 0) | (hit <= 0)] = np.inf
+        ranges = hit.min(axis=1) if objects.size else np.full(len(origins), np.inf)
+        ranges[ranges > max_range] = np.inf
+        return ranges
+
+
+class Walk:
+    """A figure-of-eight loop through the plot, facing the direction of travel."""
+
+    def __init__(self, extent=WALK_EXTENT, speed=WALK_SPEED):
+        self.a = extent
+        self.b = extent / 2
+        self.omega = speed / extent  # rad/s; the peak speed along x is speed
+
+    def _motion(self, t):
+        """Position, velocity and acceleration at times t (s), each (N, 2) in mm."""
+        w, phase = self.omega, self.omega * np.asarray(t, dtype=np.float64).reshape(-1)
+        position = np.column_stack((self.a * np.sin(phase), self.b * np.sin(2 * phase)))
+        velocity = np.column_stack((self.a * w * np.cos(phase), 2 * self.b * w * np.cos(2 * phase)))
+        acceleration = np.column_stack((-self.a * w * w * np.sin(phase),
+                                        -4 * self.b * w * w * np.sin(2 * phase)))
+        return position, velocity, acceleration
+
+    def pose(self, t):
+        """(N, 2) positions (mm) and (N,) headings (degrees) at times t (s)."""
+        position, velocity, _ = self._motion(t)
+        return position, np.degrees(np.arctan2(velocity[:, 1], velocity[:, 0]))
+
+    def imu(self, t):
+        """Body-frame linear acceleration (m/s^2), yaw rate (rad/s) and heading (degrees) at t."""
+        _, velocity, acceleration = self._motion(t)
+        heading = np.arctan2(velocity[0, 1], velocity[0, 0])
+        yaw_rate = ((velocity[0, 0] * acceleration[0, 1] - velocity[0, 1] * acceleration[0, 0])
+                    / (velocity[0] @ velocity[0]))
+        c, s = np.cos(heading), np.sin(heading)
+        ax, ay = acceleration[0] / 1000.0
+        return np.array([c * ax + s * ay, -s * ax + c * ay, 0.0]), yaw_rate, np.degrees(heading)
+
+
+class FakeRPLidar:
+    """Stand-in for rplidar.RPLidar that ray-casts rotations of the scene as it is walked.
+
+    Each beam is cast from the pose at the moment it fires, so scans carry the same
+    motion skew as the real sensor. If the reader falls more than max_buf_meas
+    measurements behind, the backlog is discarded, as the driver does on an overrun.
+    """
+
+    def __init__(self, scene, walk, clock, rate=LIDAR_RATE, samples=LIDAR_SAMPLES,
+                 height=LIDAR_HEIGHT, noise=LIDAR_NOISE, dropout=LIDAR_DROPOUT,
+                 max_range=LIDAR_RANGE, seed=1):
+        self.scene = scene
+        self.walk = walk
+        self.clock = clock
+        self.rate = rate
+        self.samples = samples
+        self.height = height
+        self.noise = noise
+        self.dropout = dropout
+        self.max_range = max_range
+        self.rng = np.random.default_rng(seed)
+        self.stopping = threading.Event()
+        self.rotations = 0
+        self.overruns = 0
+
+    def scan(self, started):
+        """One rotation that began at simulated time started, as (quality, angle, distance) tuples."""
+        fraction = (np.arange(self.samples) + self.rng.random()) / self.samples
+        angles = fraction * 360.0
+        position, heading = self.walk.pose(started + fraction / self.rate)
+        theta = np.radians(heading + angles)
+        directions = np.column_stack((np.cos(theta), np.sin(theta)))
+        distances = self.scene.ray_cast(position, directions, self.height, self.max_range)
+        distances += self.rng.normal(0.0, self.noise, self.samples)
+        # The driver only reports beams that returned
+        returned = np.isfinite(distances) & (self.rng.random(self.samples) >= self.dropout)
+        qualities = np.where(distances < self.max_range / 2, 15, 10)
+        return list(zip(qualities[returned].tolist(), angles[returned].tolist(),
+                        distances[returned].tolist()))
+
+    def iter_scans(self, max_buf_meas=3000, min_len=5):
+        self.stopping.clear()
+        rotation = int(self.clock.now() * self.rate)
+        while not self.stopping.is_set():
+            if self.clock.sleep_until((rotation + 1) / self.rate, self.stopping):
+                return
+            behind = self.clock.now() * self.rate - (rotation + 1)
+            if max_buf_meas and behind * self.samples > max_buf_meas:
+                self.overruns += 1
+                rotation += int(behind)
+            scan = self.scan(rotation / self.rate)
+            rotation += 1
+            self.rotations += 1
+            if len(scan) >= min_len:
+                yield scan
+
+    def stop(self):
+        self.stopping.set()
+
+    def stop_motor(self):
+        pass
+
+    def start_motor(self):
+        pass
+
+    def clean_input(self):
+        pass
+
+    def disconnect(self):
+        self.stopping.set()
+
+    def get_info(self):
+        return {"model": 24, "firmware": (1, 29), "hardware": 7, "serialnumber": "SIMULATED"}
+
+    def get_health(self):
+        return "Good", 0
+
+
+class FakeBNO055:
+    """Stand-in for adafruit_bno055.BNO055_I2C with fusion outputs of the walk.
+
+    Outputs change at rate (simulated Hz) and are the same whether read through the
+    properties or as one register block through i2c_device, as BurstImu does.
+    """
+
+    def __init__(self, walk, clock, rate=IMU_RATE, noise=IMU_NOISE, seed=2):
+        self.walk = walk
+        self.clock = clock
+        self.rate = rate
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.mode = 0x0C
+        self.i2c_device = self
+        self.lock = threading.Lock()
+        self.sample = None
+        self.values = None
+        self.transactions = 0
+
+    def _values(self):
+        """The 22 decoded block values of the current output sample."""
+        sample = int(self.clock.now() * self.rate)
+        with self.lock:
+            if sample != self.sample:
+                linear, yaw_rate, heading = self.walk.imu(sample / self.rate)
+                linear = linear + self.rng.normal(0.0, self.noise, 3)
+                gravity = np.array([0.0, 0.0, GRAVITY])
+                half = np.radians(heading) / 2
+                east = np.radians(-heading)
+                self.values = np.concatenate((
+                    linear + gravity,                                    # acceleration
+                    [20.0 * np.cos(east), 20.0 * np.sin(east), -40.0],   # magnetic
+                    [0.0, 0.0, yaw_rate],                                # gyro
+                    [heading % 360.0, 0.0, 0.0],                         # euler
+                    [np.cos(half), 0.0, 0.0, np.sin(half)],              # quaternion
+                    linear, gravity,
+                ))
+                self.sample = sample
+            return self.values
+
+    def _field(self, start, count):
+        return tuple(float(v) for v in self._values()[start:start + count])
+
+    # The I2CDevice side, for BurstImu
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write_then_readinto(self, out_buffer, in_buffer):
+        self.transactions += 1
+        raw = np.clip(np.rint(self._values() / SCALES), -32768, 32767).astype("<i2")
+        block = raw.tobytes() + bytes([25])  # temperature, degrees C
+        in_buffer[:] = block[:DATA_LENGTH]
+
+    # The driver properties
+    @property
+    def acceleration(self):
+        return self._field(0, 3)
+
+    @property
+    def magnetic(self):
+        return self._field(3, 3)
+
+    @property
+    def gyro(self):
+        return self._field(6, 3)
+
+    @property
+    def euler(self):
+        return self._field(9, 3)
+
+    @property
+    def quaternion(self):
+        return self._field(12, 4)
+
+    @property
+    def linear_acceleration(self):
+        return self._field(16, 3)
+
+    @property
+    def gravity(self):
+        return self._field(19, 3)
+
+    @property
+    def temperature(self):
+        return 25
+
+
+class SimulatedTof(FakeTofSensor):
+    """FakeTofSensor looking down at the fuel bed under the walk, with noise and dropouts.
+
+    timing_budget is reported in wall-clock ms, so TofReader paces itself to the
+    simulated rate.
+    """
+
+    def __init__(self, scene, walk, clock, timing_budget=TOF_BUDGET, height=TOF_HEIGHT,
+                 noise=TOF_NOISE, dropout=TOF_DROPOUT, seed=3):
+        super().__init__(timing_budget=timing_budget / clock.speed)
+        self.scene = scene
+        self.walk = walk
+        self.clock = clock
+        self.height = height
+        self.noise = noise
+        self.dropout = dropout
+        self.rng = np.random.default_rng(seed)
+
+    @property
+    def distance(self):
+        self.transactions += 1
+        if self.rng.random() < self.dropout:
+            return 0.0
+        position, _ = self.walk.pose(self.clock.now())
+        depth = self.scene.fuel_depth(position[0, 0], position[0, 1])
+        # Foliage above the mount reads as no target, like a dropout
+        distance = (self.height - depth) / 10.0 + self.rng.normal(0.0, self.noise)
+        return round(float(distance), 1) if distance > 0 else 0.0
+
+
+def synthetic_jpeg(size=IMAGE_SIZE, seed=4, quality=90):
+    """JPEG bytes of a mottled forest-floor texture; PLACEHOLDER_JPEG without Pillow."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return PLACEHOLDER_JPEG
+    import io
+
+    rng = np.random.default_rng(seed)
+    width, height = size
+    # Coarse patches of litter colours with fine grain on top, so the file size and
+    # decode cost are close to a real photograph's
+    palette = np.array([[84, 62, 38], [112, 96, 52], [58, 82, 40], [140, 120, 86]], dtype=np.float32)
+    coarse = palette[rng.integers(0, len(palette), (height // 16 + 1, width // 16 + 1))]
+    image = Image.fromarray(coarse.astype(np.uint8)).resize((width, height), Image.BILINEAR)
+    pixels = np.asarray(image, dtype=np.float32) + rng.normal(0.0, 18.0, (height, width, 1))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class Simulation:
+    """One scene, walk and simulated clock shared by the fake sensors it creates."""
+
+    def __init__(self, speed=SPEED, seed=0, walk_extent=WALK_EXTENT, walk_speed=WALK_SPEED):
+        self.clock = SimulatedTime(speed)
+        self.scene = ForestScene(seed)
+        self.walk = Walk(walk_extent, walk_speed)
+
+    @property
+    def speed(self):
+        return self.clock.speed
+
+    def lidar(self, **kwargs):
+        return FakeRPLidar(self.scene, self.walk, self.clock, **kwargs)
+
+    def imu(self, **kwargs):
+        return FakeBNO055(self.walk, self.clock, **kwargs)
+
+    def tof(self, **kwargs):
+        return SimulatedTof(self.scene, self.walk, self.clock, **kwargs)
+
+    def camera(self, delay=CAPTURE_DELAY, size=IMAGE_SIZE, fail_every=0):
+        """A FakeCamera writing a full-size synthetic still, with the delay scaled to the speed."""
+        return FakeCamera(delay / self.speed, fail_every, data=synthetic_jpeg(size))
+
+
+if __name__ == '__main__':
+    # Drive the real readers from the fakes at several speeds and report the rates they
+    # sustain, with the scan matcher tracking the walk
+    import argparse
+
+    from imu import BurstImu
+    from kalman import ImuFilter
+    from lidar_reader import LidarReader
+    from scanmatch import ScanMatcher
+    from scheduler import Scheduler
+    from tof_reader import TofReader
+
+    parser = argparse.ArgumentParser(description="Run the sensor readers on simulated sensors")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[1.0, 10.0, 50.0])
+    parser.add_argument("--duration", type=float, default=3.0, help="wall-clock seconds per speed")
+    options = parser.parse_args()
+
+    for speed in options.speeds:
+        simulation = Simulation(speed)
+        lidar = simulation.lidar()
+        imu_sensor = simulation.imu()
+        matcher = ScanMatcher(lambda: imu_sensor.euler[0])
+        kalman = ImuFilter(BurstImu(imu_sensor), rate=IMU_RATE * speed)
+        scheduler = Scheduler()
+        scheduler.add("imu", kalman.step, IMU_RATE * speed)
+        readers = [LidarReader(lidar, callback=matcher), TofReader(simulation.tof()), scheduler]
+        for reader in readers:
+            reader.start()
+        time.sleep(options.duration)
+        for reader in readers:
+            reader.stop()
+        lidar_reader, tof_reader, _ = readers
+
+        # Compare the tracked displacement with the walk's, both from the first matched scan
+        poses = list(matcher.poses)
+        first, last = poses[0], poses[-1]
+        times = (np.array([first.timestamp, last.timestamp]) / 1e9 - simulation.clock.started) * speed
+        position, _ = simulation.walk.pose(times)
+        error = np.hypot(*(np.array([last.x - first.x, last.y - first.y]) - (position[1] - position[0])))
+        print(f"speed {speed:g}x: LiDAR {lidar_reader.scan_count / options.duration:.1f} scans/s "
+              f"({lidar.rotations} rotations, {lidar.overruns} overruns), "
+              f"ToF {tof_reader.reading_count / options.duration:.1f}/s, "
+              f"IMU {kalman.samples / options.duration:.0f}/s; scans {matcher.matched} matched, "
+              f"{matcher.failed} failed, {error:.0f} mm drift over "
+              f"{np.hypot(*(position[1] - position[0])):.0f} mm")
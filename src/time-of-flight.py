@@ -2,6 +2,8 @@ import board
 import adafruit_vl53l4cd
 import time
 import csv
+import os
+from tof_reader import TofReader
 
 i2c = board.I2C()
 vl53 = adafruit_vl53l4cd.VL53L4CD(i2c)
@@ -9,6 +11,9 @@ calibration_val = 1.5
 timeout = 0.5  # Timeout in seconds
 
 vl53.start_ranging()
+tof_interrupt_pin = os.getenv('TOF_INTERRUPT_PIN')
+tof_reader = TofReader(vl53, interrupt_pin=int(tof_interrupt_pin) if tof_interrupt_pin else None)
+tof_reader.start()
 
 # Open the CSV file in append mode
 with open("sensor_data.csv", "a", newline='') as csvfile:
@@ -24,15 +29,12 @@ with open("sensor_data.csv", "a", newline='') as csvfile:
             start_time = time.time()
 
             # Wait for sensor data or timeout
-            timeout_start = time.time()
-            while not vl53.data_ready:
-                if time.time() - timeout_start > timeout:
-                    print("Timeout waiting for sensor data.")
-                    break
+            reading = tof_reader.wait_next(timeout)
+            if reading is None:
+                print("Timeout waiting for sensor data.")
 
-            if vl53.data_ready:
-                vl53.clear_interrupt()
-                distance = vl53.distance - calibration_val
+            if reading is not None:
+                distance = reading.distance - calibration_val
 
                 # Get the current timestamp
                 timestamp = int(time.time())
@@ -49,3 +51,5 @@ with open("sensor_data.csv", "a", newline='') as csvfile:
                 time.sleep(remaining_time)
     except KeyboardInterrupt:
         print("Program interrupted. Data saved to sensor_data.csv.")
+    finally:
+        tof_reader.stop()
@@ -0,0 +1,187 @@
+"""Event-driven VL53L4CD reader: waits on the GPIO1 interrupt line or polls with adaptive sleeps."""
+
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from clock import sensor_clock
+
+QUEUE_SIZE = 64
+POLL_DIVISIONS = 10   # polls per measurement period once a reading is due
+MIN_POLL = 0.001      # seconds, floor for the polling sleep
+ERROR_DELAY = 0.1     # seconds to back off after a failed bus transaction
+
+# timestamp is a monotonic ns stamp taken when the reading was found ready,
+# distance is the raw sensor value in cm; transactions counts the I2C
+# transfers spent on this reading (readiness checks, interrupt clear and distance read)
+TofReading = namedtuple("TofReading", ["timestamp", "distance", "transactions"])
+
+
+class TofReader(threading.Thread):
+    """Delivers VL53L4CD readings to a callback or a queue without spinning on data_ready.
+
+    With interrupt_pin set (BCM number of the sensor's GPIO1 line) the thread sleeps on the
+    falling edge; otherwise it sleeps for most of the measurement period and then polls
+    data_ready a few times per period, learning the real period from observed readings.
+    """
+
+    def __init__(self, sensor, interrupt_pin=None, callback=None, maxsize=QUEUE_SIZE):
+        super().__init__(name="tof-reader", daemon=True)
+        self.sensor = sensor
+        self.callback = callback
+        self.readings = queue.Queue(maxsize)
+        self.stopping = threading.Event()
+        self.new_reading = threading.Condition()
+        self.last = None
+        self.dropped = 0
+        self.total_transactions = 0
+        self.reading_count = 0
+        self.errors = 0
+
+        # The sensor produces a reading every max(timing budget, inter-measurement) ms
+        period_ms = max(sensor.timing_budget, sensor.inter_measurement)
+        self.period = period_ms / 1000.0
+
+        self.interrupt = None
+        if interrupt_pin is not None:
+            from gpiozero import DigitalInputDevice
+            # GPIO1 is open drain and active low, so pull it up and treat low as ready
+            self.interrupt = DigitalInputDevice(interrupt_pin, pull_up=True)
+
+    def _wait_interrupt(self):
+        """Sleep until the interrupt line signals a reading; costs no bus transactions."""
+        while not self.stopping.is_set():
+            if self.interrupt.wait_for_active(timeout=0.1):
+                return 0
+        return None
+
+    def _wait_polling(self, last_time):
+        """Sleep until a reading is due, then poll data_ready; returns the number of polls."""
+        due = last_time + self.period
+        delay = due - time.monotonic()
+        if delay > 0 and self.stopping.wait(delay * 0.9):
+            return None
+        step = max(self.period / POLL_DIVISIONS, MIN_POLL)
+        polls = 0
+        while not self.stopping.is_set():
+            polls += 1
+            if self.sensor.data_ready:
+                return polls
+            self.stopping.wait(step)
+        return None
+
+    def run(self):
+        last_time = time.monotonic()
+        while not self.stopping.is_set():
+            try:
+                if self.interrupt is not None:
+                    transactions = self._wait_interrupt()
+                else:
+                    transactions = self._wait_polling(last_time)
+                if transactions is None:
+                    break
+                timestamp = sensor_clock.now()
+                self.sensor.clear_interrupt()
+                distance = self.sensor.distance
+            except Exception as e:
+                # The I2C bus is shared with the IMU; a failed transfer costs one reading
+                self.errors += 1
+                print(f"TOF read error: {str(e)}")
+                self.stopping.wait(ERROR_DELAY)
+                continue
+            now = timestamp / 1e9
+            sensor_clock.record("tof", timestamp)
+            transactions += 2
+            if self.reading_count:
+                # Track the real output period, which drifts from the configured one
+                self.period += 0.1 * ((now - last_time) - self.period)
+            last_time = now
+            self._deliver(TofReading(timestamp, distance, transactions))
+
+    def _deliver(self, reading):
+        self.reading_count += 1
+        self.total_transactions += reading.transactions
+        with self.new_reading:
+            self.last = reading
+            self.new_reading.notify_all()
+        if self.callback is not None:
+            try:
+                self.callback(reading)
+            except Exception as e:
+                print(f"TOF reading callback error: {str(e)}")
+            return
+        try:
+            self.readings.put_nowait(reading)
+        except queue.Full:
+            # Keep the newest readings if nobody is draining the queue
+            self.readings.get_nowait()
+            self.readings.put_nowait(reading)
+            self.dropped += 1
+
+    def read(self, timeout=None):
+        """Pop the next queued reading, or None on timeout."""
+        try:
+            return self.readings.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def latest(self, max_age=None):
+        """Return the newest reading, or None if there is none younger than max_age seconds."""
+        reading = self.last
+        if reading is None or (max_age is not None and sensor_clock.age(reading.timestamp) > max_age):
+            return None
+        return reading
+
+    def wait_next(self, timeout=None):
+        """Wait for a reading newer than the current one, or None on timeout."""
+        with self.new_reading:
+            current = self.last
+            self.new_reading.wait_for(lambda: self.last is not current, timeout)
+            return self.last if self.last is not current else None
+
+    def transactions_per_reading(self):
+        if not self.reading_count:
+            return 0.0
+        return self.total_transactions / self.reading_count
+
+    def stop(self):
+        self.stopping.set()
+        self.join(timeout=1.0)
+        if self.interrupt is not None:
+            self.interrupt.close()
+
+
+class FakeTofSensor:
+    """Stand-in for adafruit_vl53l4cd.VL53L4CD that produces a reading every period."""
+
+    def __init__(self, distance=30.0, timing_budget=50, inter_measurement=0):
+        self._distance = distance
+        self.timing_budget = timing_budget
+        self.inter_measurement = inter_measurement
+        self.transactions = 0
+        self._started = time.monotonic()
+
+    def _ready_at(self):
+        period = max(self.timing_budget, self.inter_measurement) / 1000.0
+        return self._started + period
+
+    @property
+    def data_ready(self):
+        self.transactions += 1
+        return time.monotonic() >= self._ready_at()
+
+    @property
+    def distance(self):
+        self.transactions += 1
+        return self._distance
+
+    def clear_interrupt(self):
+        self.transactions += 1
+        self._started = time.monotonic()
+
+    def start_ranging(self):
+        self._started = time.monotonic()
+
+    def stop_ranging(self):
+        pass
@@ -0,0 +1,391 @@
+"""Background Firebase uploader fed from a persistent on-disk job queue.
+
+Jobs are stored in SQLite before enqueue returns, so nothing is lost if the network is
+down or the device restarts. Every job has a stable destination (a pre-generated
+database key or a fixed blob name), so a job retried after a crash overwrites its own
+earlier attempt instead of creating a duplicate.
+
+Outages and other transient failures are retried with backoff for as long as they
+last. A job the backend refuses outright (invalid data, permission denied, other 4xx)
+is moved to the failed_jobs table after MAX_ATTEMPTS tries, so one bad job cannot be
+retried forever.
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from clock import sensor_clock
+
+BATCH_SIZE = 100      # database records per multi-path update
+WORKERS = 4           # parallel Storage uploads
+POLL_INTERVAL = 0.5   # seconds between queue scans when idle
+BACKOFF_BASE = 1.0    # seconds before the first retry
+BACKOFF_MAX = 300.0   # cap on the retry delay, so uploads resume soon after reconnecting
+MAX_ATTEMPTS = 8      # tries before a job the backend keeps refusing is set aside
+# firebase_admin.exceptions.FirebaseError codes that no retry can fix
+PERMANENT_CODES = {"INVALID_ARGUMENT", "FAILED_PRECONDITION", "OUT_OF_RANGE", "UNAUTHENTICATED",
+                   "PERMISSION_DENIED", "NOT_FOUND", "ALREADY_EXISTS", "CONFLICT"}
+
+RECORD = "record"
+FILE = "file"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    running INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (kind, key)
+);
+CREATE TABLE IF NOT EXISTS failed_jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT NOT NULL,
+    failed_at REAL NOT NULL
+)
+"""
+
+
+def is_permanent(error):
+    """True if retrying cannot fix error: the backend refused the request itself.
+
+    Outages surface as OSError (requests, sockets), firebase_admin's UnavailableError or
+    DeadlineExceededError, or google-api-core's ServiceUnavailable or RetryError; all of
+    these, and anything unrecognised, count as transient so queued jobs survive them.
+    """
+    if isinstance(error, OSError):
+        return False
+    code = getattr(error, "code", None)
+    if isinstance(code, str):  # firebase_admin: a canonical error code
+        return code in PERMANENT_CODES
+    if isinstance(code, int):  # google-api-core: the HTTP status
+        return 400 <= code < 500 and code not in (408, 429)
+    return isinstance(error, (TypeError, ValueError))  # a payload that cannot be sent
+
+
+def push_key():
+    """Time-ordered database key, generated locally so retries reuse it."""
+    return f"{time.time_ns():020d}-{random.getrandbits(32):08x}"
+
+
+class FirebaseBackend:
+    """Realtime Database and Storage calls used by the uploader."""
+
+    def __init__(self, bucket, db):
+        self.bucket = bucket
+        self.root = db.reference('/')
+
+    def update(self, values):
+        """Write many database paths in one multi-path update request."""
+        self.root.update(values)
+
+    def upload(self, local_path, name, content_type):
+        # Blobs share the bucket's client and its pooled HTTP session
+        blob = self.bucket.blob(name)
+        blob.upload_from_filename(local_path, content_type=content_type)
+
+    def public_url(self, name):
+        """URL a blob will have once uploaded; computed locally without a request."""
+        return self.bucket.blob(name).public_url
+
+
+class FakeFirebaseError(Exception):
+    """Error carrying a firebase_admin-style code, e.g. UNAVAILABLE during an outage."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeFirebase:
+    """In-memory stand-in for FirebaseBackend with switchable outages, for testing.
+
+    Outages raise UNAVAILABLE and rejected keys INVALID_ARGUMENT, like firebase_admin,
+    which are not OSErrors.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, online=True, reject=()):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.online = online
+        self.reject = set(reject)  # paths and blob names refused outright, like invalid data
+        self.database = {}
+        self.blobs = {}
+        self.writes = Counter()  # successful writes per path or blob name
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _request(self, keys):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.online or random.random() < self.failure_rate:
+            raise FakeFirebaseError("UNAVAILABLE", "simulated network failure")
+        rejected = self.reject.intersection(keys)
+        if rejected:
+            raise FakeFirebaseError("INVALID_ARGUMENT", f"simulated rejection of {sorted(rejected)}")
+
+    def update(self, values):
+        self._request(values)
+        with self.lock:
+            self.database.update(values)
+            self.writes.update(values.keys())
+
+    def upload(self, local_path, name, content_type):
+        self._request([name])
+        with open(local_path, "rb") as f:
+            data = f.read()
+        with self.lock:
+            self.blobs[name] = (content_type, data)
+            self.writes[name] += 1
+
+    def public_url(self, name):
+        return f"https://storage.example/{name}"
+
+
+class Uploader:
+    """Drains the job queue on background threads; enqueue only touches the local database."""
+
+    def __init__(self, backend, spool_path, batch_size=BATCH_SIZE, workers=WORKERS):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(spool_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # Jobs that were in flight when the last session ended are simply retried
+        self.conn.execute("UPDATE jobs SET running = 0")
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self.workers = workers
+        self.inflight = 0
+        self.uploaded = 0
+        self.failures = 0
+        self.abandoned = 0
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="uploader", daemon=True)
+        self.thread.start()
+
+    def _insert(self, kind, key, payload, priority=0):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO jobs (kind, key, payload, priority) VALUES (?, ?, ?, ?)",
+                (kind, key, json.dumps(payload, default=str), priority))
+        self.wakeup.set()
+
+    def enqueue_record(self, parent, data, key=None):
+        """Queue data for parent/<key> in the Realtime Database and return the key."""
+        key = key or push_key()
+        self._insert(RECORD, f"{parent}/{key}", data)
+        return key
+
+    def enqueue_file(self, local_path, name=None, content_type='image/jpeg', priority=0):
+        """Queue a Storage upload and return the blob's public URL; higher priority goes first."""
+        name = name or os.path.basename(local_path)
+        self._insert(FILE, name, {"path": local_path, "content_type": content_type}, priority)
+        return self.backend.public_url(name)
+
+    def public_url(self, name):
+        """Public URL of a blob, whether or not it has been queued yet."""
+        return self.backend.public_url(name)
+
+    def pending(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def _due(self, kind, limit):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, key, payload, attempts FROM jobs WHERE kind = ? AND running = 0 "
+                "AND next_attempt <= ? ORDER BY priority DESC, id LIMIT ?",
+                (kind, time.time(), limit)).fetchall()
+            if rows:
+                self.conn.executemany("UPDATE jobs SET running = 1 WHERE id = ?",
+                                      [(row[0],) for row in rows])
+        return rows
+
+    def _done(self, ids):
+        with self.lock:
+            self.conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in ids])
+            self.uploaded += len(ids)
+
+    def _retry(self, rows, error):
+        with self.lock:
+            self.failures += 1
+        now = time.time()
+        # Outages are waited out however long they last; only a refusal is the job's fault
+        if is_permanent(error):
+            poisoned = [row for row in rows if row[3] + 1 >= MAX_ATTEMPTS]
+            if poisoned:
+                self._abandon(poisoned, error, now)
+                rows = [row for row in rows if row[3] + 1 < MAX_ATTEMPTS]
+        if not rows:
+            return
+        print(f"Upload failed, will retry: {str(error)}")
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE jobs SET running = 0, attempts = ?, next_attempt = ? WHERE id = ?",
+                [(attempts + 1, now + self._backoff(attempts), job_id)
+                 for job_id, _, _, attempts in rows])
+
+    def _abandon(self, rows, error, now):
+        """Move jobs out of the queue into failed_jobs, where they are kept for inspection."""
+        print(f"Upload failed {MAX_ATTEMPTS} times, giving up on {len(rows)} job(s): {str(error)}")
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO failed_jobs (id, kind, key, payload, attempts, error, failed_at) "
+                "SELECT id, kind, key, payload, attempts + 1, ?, ? FROM jobs WHERE id = ?",
+                [(str(error), now, row[0]) for row in rows])
+            self.conn.executemany("DELETE FROM jobs WHERE id = ?", [(row[0],) for row in rows])
+            self.conn.execute("COMMIT")
+            self.abandoned += len(rows)
+
+    def _backoff(self, attempts):
+        # Exponential with jitter so many queued jobs do not retry in lockstep
+        return random.uniform(0.5, 1.0) * min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts)
+
+    def _send_records(self, rows):
+        values = {key: json.loads(payload) for _, key, payload, _ in rows}
+        try:
+            with sensor_clock.measure("upload"):
+                self.backend.update(values)
+        except Exception as e:
+            if not is_permanent(e) or len(rows) == 1:
+                self._retry(rows, e)
+                return
+            # A rejected batch is resent one record at a time, so only the bad one is retried
+            for row in rows:
+                self._send_records([row])
+            return
+        self._done([row[0] for row in rows])
+
+    def _send_file(self, row):
+        job_id, name, payload, _ = row
+        job = json.loads(payload)
+        try:
+            if not os.path.exists(job["path"]):
+                print(f"Skipping upload of missing file {job['path']}")
+            else:
+                with sensor_clock.measure("upload"):
+                    self.backend.upload(job["path"], name, job["content_type"])
+        except Exception as e:
+            self._retry([row], e)
+        else:
+            self._done([job_id])
+        finally:
+            with self.lock:
+                self.inflight -= 1
+            self.wakeup.set()
+
+    def _run(self):
+        while not self.stopping.is_set():
+            self.wakeup.clear()
+            busy = False
+            with self.lock:
+                free = self.workers - self.inflight
+            if free > 0:
+                for row in self._due(FILE, free):
+                    with self.lock:
+                        self.inflight += 1
+                    self.pool.submit(self._send_file, row)
+                    busy = True
+            rows = self._due(RECORD, self.batch_size)
+            if rows:
+                self._send_records(rows)
+                busy = True
+            if not busy:
+                self.wakeup.wait(POLL_INTERVAL)
+
+    def flush(self, timeout=None):
+        """Wait until the queue is empty or timeout expires; returns True if it drained."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stop(self, drain_timeout=5.0):
+        """Give queued jobs a moment to finish, then stop; unfinished jobs stay on disk."""
+        self.flush(drain_timeout)
+        self.stopping.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.pool.shutdown(wait=True)
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET running = 0")
+            self.conn.close()
+
+
+if __name__ == '__main__':
+    # Against the fake backend: queue jobs through an outage, restart on the same queue,
+    # then check every job landed exactly once and a rejected job is set aside
+    import tempfile
+
+    BACKOFF_BASE = 0.01  # retry within the check rather than after seconds
+    BACKOFF_MAX = 0.1
+    scratch = tempfile.mkdtemp(prefix="uploader-check-")
+    spool = os.path.join(scratch, "queue.db")
+    files = []
+    for i in range(5):
+        files.append(os.path.join(scratch, f"image_{i}.jpg"))
+        with open(files[-1], "wb") as f:
+            f.write(bytes([i]) * 1000)
+
+    backend = FakeFirebase(online=False)
+    uploader = Uploader(backend, spool)
+    keys = [uploader.enqueue_record("sensor_data_latest", {"n": i}) for i in range(50)]
+    for path in files:
+        uploader.enqueue_file(path)
+    # Stay offline well past MAX_ATTEMPTS tries: an outage never makes a job permanent
+    def fewest_attempts():
+        with uploader.lock:
+            return uploader.conn.execute("SELECT MIN(attempts) FROM jobs").fetchone()[0]
+
+    deadline = time.monotonic() + 30
+    while fewest_attempts() <= MAX_ATTEMPTS and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not backend.writes and uploader.failures, "nothing should land while offline"
+    assert not uploader.abandoned and uploader.pending() == 55, "an outage must not drop jobs"
+    uploader.stop(drain_timeout=0)  # the device is switched off mid-outage
+
+    # Back online, but flaky; the queue survives the restart
+    uploader = Uploader(backend, spool)
+    assert uploader.pending() == 55
+    backend.failure_rate = 0.3
+    backend.online = True
+    assert uploader.flush(timeout=30), f"{uploader.pending()} jobs still queued"
+    retries = uploader.failures
+    uploader.stop()
+    expected = {f"sensor_data_latest/{key}" for key in keys} | {os.path.basename(p) for p in files}
+    assert set(backend.writes) == expected and set(backend.writes.values()) == {1}, backend.writes
+    print(f"55 jobs landed exactly once across an outage and a restart ({retries} failed attempts)")
+
+    # A record the backend always refuses is set aside; its batch-mates still land
+    backend.failure_rate = 0.0
+    uploader = Uploader(backend, spool)
+    bad = uploader.enqueue_record("sensor_data_latest", {"n": "bad"}, key="bad")
+    backend.reject.add(f"sensor_data_latest/{bad}")
+    good = [uploader.enqueue_record("sensor_data_latest", {"n": i}) for i in range(3)]
+    assert uploader.flush(timeout=30), f"{uploader.pending()} jobs still queued"
+    uploader.stop()
+    failed = sqlite3.connect(spool).execute("SELECT key, attempts FROM failed_jobs").fetchall()
+    assert failed == [(f"sensor_data_latest/{bad}", MAX_ATTEMPTS)], failed
+    assert all(backend.writes[f"sensor_data_latest/{key}"] == 1 for key in good)
+    print(f"rejected job set aside after {MAX_ATTEMPTS} attempts, the rest of its batch landed")
@@ -12,6 +12,10 @@ data = pd.read_csv(csv_path)
 # Function to display an image and its corresponding height value
 def display_image_and_height(row):
     image_path = os.path.join(data_dir, row["Image Path"])
+    # Prefer the downscaled preview written beside each capture over the 16 MP original
+    preview_path = os.path.splitext(image_path)[0] + ".preview.jpg"
+    if os.path.exists(preview_path):
+        image_path = preview_path
     st.image(image_path, use_column_width=True)
     st.write(f"Height: {row['Height (cm)']} cm")
 
@@ -2,130 +2,323 @@
 ## Originally written and named as wildbioscan5.py
 ## Improvements over earlier versions - On image capture all other sensor data is captured
 
-import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from rplidar import RPLidar
-import board
-import busio
-import adafruit_vl53l4cd
-import adafruit_bno055
+import argparse
+import asyncio
+import json
 import time
 import os
-import subprocess
-import firebase_admin
-from firebase_admin import credentials, storage, db
+import mimetypes
+import resource
+import signal
+import threading
+import numpy as np
 from dotenv import load_dotenv
-from filterpy.kalman import KalmanFilter
+from camera import open_camera
+from clock import sensor_clock
+from derivatives import DerivativePool
+from heightgrid import HeightGrid
+from imu import WORDS as IMU_WORDS, BurstImu, to_snapshot
+from kalman import RATE as KALMAN_RATE, ImuFilter
+from lidar_reader import LidarReader
+from metrics import MetricsServer, SnapshotWriter, metrics
+from occupancy import OccupancyGrid
+from tracing import tracer
+import pc_codec
+from pointcloud import PointCloud
+from render import LIVE, SNAPSHOTS, Renderer
+from scanmatch import ScanMatcher
+from scheduler import Scheduler, StreamBuffer
+from session_store import SessionWriter
+from tof_reader import TofReader
+from transform import TrigTable, scan_to_3D, scan_to_arrays
+from uploader import FakeFirebase, FirebaseBackend, Uploader
+from voxelgrid import VoxelGrid
+from orchestrator import Orchestrator, BLOCK, DROP_OLDEST
 
 # Load environment variables
 load_dotenv()
 
+parser = argparse.ArgumentParser(description="WildBioScan fuel load capture")
+parser.add_argument("--headless", action="store_true",
+                    help="no point-cloud rendering; Matplotlib is never imported")
+parser.add_argument("--snapshots", metavar="DIR",
+                    help="render PNG snapshots into DIR instead of a live window")
+parser.add_argument("--simulate", metavar="SPEED", type=float, nargs="?", const=1.0,
+                    help="run on simulated sensors and an in-memory Firebase, SPEED times "
+                         "faster than real time (default 1)")
+parser.add_argument("--cycles", type=int,
+                    help="stop after this many capture cycles, once every record is processed")
+parser.add_argument("--stats", metavar="PATH",
+                    help="write stage latencies, throughput and resource use as JSON on exit")
+parser.add_argument("--trace", metavar="PATH",
+                    help="record spans of every stage and sensor read and write them to PATH as "
+                         "Chrome Trace Event JSON on exit, or on SIGUSR1 while running")
+args = parser.parse_args()
+# Simulated sensors run the whole pipeline without the device, and at several times the
+# real sensor rates for load testing; the capture interval is scaled to match
+SPEED = args.simulate or 1.0
+
+# Rendering runs in its own process, started before any sensor thread so the fork is clean
+renderer = None if args.headless else Renderer(SNAPSHOTS if args.snapshots else LIVE, args.snapshots)
+# Thumbnails and previews are decoded at reduced size in worker processes, also forked
+# before the sensor threads start
+derivative_pool = DerivativePool(reencode=os.getenv('IMAGE_REENCODE'))
+
 # Firebase setup
-cred = credentials.Certificate(os.getenv('FIREBASE_CREDENTIALS_PATH'))
-firebase_admin.initialize_app(cred, {
-    'databaseURL': os.getenv('FIREBASE_DATABASE_URL'),
-    'storageBucket': os.getenv('FIREBASE_STORAGE_BUCKET')
-})
-bucket = storage.bucket()
+if args.simulate:
+    backend = FakeFirebase()
+else:
+    import firebase_admin
+    from firebase_admin import credentials, storage, db
+
+    cred = credentials.Certificate(os.getenv('FIREBASE_CREDENTIALS_PATH'))
+    firebase_admin.initialize_app(cred, {
+        'databaseURL': os.getenv('FIREBASE_DATABASE_URL'),
+        'storageBucket': os.getenv('FIREBASE_STORAGE_BUCKET')
+    })
+    backend = FirebaseBackend(storage.bucket(), db)
+# Uploads run in the background from an on-disk queue, so the capture loop never waits
+# on the network and jobs left over from an offline session are sent on the next run
+uploader = Uploader(backend, os.getenv('UPLOAD_QUEUE_PATH', os.path.join(os.getcwd(), 'upload_queue.db')))
+
+# Every raw sample is kept on the SD card first, so capture works without connectivity
+session = SessionWriter(os.path.join(os.getenv('SESSION_DIR', os.getcwd()),
+                                     f"session_{time.strftime('%Y%m%d_%H%M%S')}.wbs"))
+
+# Each sensor runs at its own rate on its own thread and logs every sample to the session;
+# captures take the newest or interpolated values from these streams instead of reading
+# the sensors once per capture
+IMU_RATE = float(os.getenv('IMU_RATE', KALMAN_RATE))  # Hz, polled by the scheduler
+TOF_RATE = float(os.getenv('TOF_RATE', 20.0))  # Hz, paced by the sensor's timing budget
+CAPTURE_INTERVAL = float(os.getenv('CAPTURE_INTERVAL', 5.0))  # seconds between camera captures
 
 # Sensor initialization
-i2c = board.I2C()
-tof_sensor = adafruit_vl53l4cd.VL53L4CD(i2c)
+if args.simulate:
+    from simulator import Simulation
+
+    simulation = Simulation(SPEED)
+    tof_sensor = simulation.tof()
+    imu_sensor = simulation.imu()
+    lidar = simulation.lidar()
+    tof_interrupt_pin = None
+else:
+    import board
+    import adafruit_vl53l4cd
+    import adafruit_bno055
+    from rplidar import RPLidar
+
+    i2c = board.I2C()
+    tof_sensor = adafruit_vl53l4cd.VL53L4CD(i2c)
+    # Back-to-back ranging, one reading per timing budget (10-200 ms)
+    tof_sensor.inter_measurement = 0
+    tof_sensor.timing_budget = int(min(max(1000.0 / TOF_RATE, 10), 200))
+    imu_sensor = adafruit_bno055.BNO055_I2C(i2c)
+    lidar = RPLidar('/dev/ttyUSB0')
+    # Readings arrive on the GPIO1 interrupt (if wired) instead of a data_ready busy-wait
+    tof_interrupt_pin = os.getenv('TOF_INTERRUPT_PIN')
+
+def log_tof(reading):
+    """TofReader callback: log every reading; captures take the newest from the reader."""
+    session.log_tof(reading.timestamp, reading.distance)
+
 tof_sensor.start_ranging()
-imu_sensor = adafruit_bno055.BNO055_I2C(i2c)
+tof_reader = TofReader(tof_sensor, interrupt_pin=int(tof_interrupt_pin) if tof_interrupt_pin else None,
+                       callback=log_tof)
+tof_reader.start()
 imu_sensor.mode = 0x0C  # NDOF mode
-lidar = RPLidar('/dev/ttyUSB0')
+
+# Kalman filter over the accelerometer, stepped with every IMU sample (with its own
+# BurstImu, since the read buffer is not shared between threads). The IMU keeps its real
+# rate in simulated runs too: sampling it SPEED times as often would only load the task's
+# thread, while the other sensors' rates follow their own simulated clocks
+kalman = ImuFilter(BurstImu(imu_sensor), rate=IMU_RATE)
+# Row of the IMU stream: the 22 decoded values, the temperature, then the filtered state
+IMU_TEMPERATURE = IMU_WORDS
+IMU_STATE = slice(IMU_WORDS + 1, None)
+EULER = slice(9, 12)  # heading, roll, pitch (degrees)
+imu_stream = StreamBuffer(IMU_WORDS + 1 + 2 * kalman.filter.axes, angles=[EULER.start])
+
+def sample_imu():
+    """Scheduler task: read and filter one IMU sample, log it and add it to the stream."""
+    sample = kalman.step()
+    if sample is None:
+        return
+    timestamp, values, temperature = sample
+    session.log_imu(timestamp, kalman.imu.block)
+    imu_stream.append(timestamp, np.concatenate((values, [temperature], kalman.filter.x)))
+
+def imu_heading():
+    """Heading (degrees) of the newest IMU sample, seeding the scan matcher."""
+    latest = imu_stream.latest()
+    return float(latest[1][EULER.start]) if latest else 0.0
+
+scheduler = Scheduler()
+scheduler.add("imu", sample_imu, IMU_RATE)
+scheduler.start()
+# Every rotation is ICP-matched against the previous one, seeded by the IMU yaw, which
+# tracks the device's translation as well as its heading
+scan_matcher = ScanMatcher(imu_heading)
+# 2D occupancy of the LiDAR plane, ray-cast from every matched scan at the scan rate
+occupancy_map = OccupancyGrid(float(os.getenv('OCCUPANCY_RESOLUTION', 50.0)))
+
+# The accumulated maps are updated on the LiDAR thread and read by captures and on exit
+map_lock = threading.Lock()
+
+def place_scan(angles, distances, qualities, yaw, pitch, pose=None):
+    """Transform a scan to 3D points, moved to its scan-matched position if it has one."""
+    points, mask = scan_to_3D(angles, distances, qualities, yaw, pitch, table=trig_table,
+                              return_mask=True)
+    if pose is not None:
+        points[:, 0] += pose.x
+        points[:, 1] += pose.y
+    return points, mask
+
+def pitch_at(timestamp):
+    """IMU pitch (degrees) at a monotonic ns stamp, 0 before the first sample."""
+    sample = imu_stream.at(timestamp)
+    return float(sample[1][EULER.stop - 1]) if sample is not None else 0.0
+
+@tracer.traced(sensor="lidar")
+def map_scan(timestamp, scan):
+    """LidarReader callback: log the scan, track the pose, then fold it into the maps."""
+    angles, distances, qualities = scan_to_arrays(scan)
+    session.log_scan(timestamp, angles, distances, qualities)
+    pose = scan_matcher.update(timestamp, scan)
+    if pose is None:
+        return
+    occupancy_map.integrate(angles, distances, (pose.x, pose.y, pose.heading))
+    # Every rotation reaches the voxel map and fuel bed once, placed with its own pose
+    points, _ = place_scan(angles, distances, qualities, pose.heading, pitch_at(timestamp), pose)
+    with map_lock:
+        voxel_map.insert(points)
+        fuel_bed.insert(points)
+# Opened once and kept streaming, so each capture only waits for the next frame
+camera = simulation.camera() if args.simulate else open_camera(os.getenv('CAMERA_BACKEND', 'auto'))
 
 # Constants
 TOF_CALIBRATION = 1.5
 TIMEOUT = 0.5  # seconds
-INTERVAL = 5   # seconds
-
-# Kalman Filter setup
-kf = KalmanFilter(dim_x=6, dim_z=3)
-kf.F = np.eye(6)  # State transition matrix
-kf.H = np.zeros((3, 6))  # Measurement function
-kf.H[:, :3] = np.eye(3)
-kf.P *= 1000.  # Covariance matrix
-kf.R = np.eye(3)  # Measurement uncertainty
-kf.Q = np.eye(6)  # Process uncertainty
-kf.x = np.zeros(6)  # Initial state
+INTERVAL = CAPTURE_INTERVAL / SPEED  # seconds
+QUEUE_SIZE = 32  # records buffered per stage before capture waits
+PREVIEW_PRIORITY = 1  # upload previews before deferred full-size originals
+CLOUD_PRECISION = 1.0  # point-cloud quantization step, in LiDAR distance units (mm)
+VOXEL_SIZE = float(os.getenv('VOXEL_SIZE', 50.0))  # accumulated map resolution (mm)
+trig_table = TrigTable()
+# Every scan of the session is merged into one voxel map whose size depends on the
+# area covered, not on how long the sweep runs
+voxel_map = VoxelGrid(VOXEL_SIZE)
+# Mount heights above the ground (mm): the LiDAR plane and the downward-looking ToF
+LIDAR_HEIGHT = float(os.getenv('LIDAR_HEIGHT', 1000.0))
+TOF_HEIGHT = float(os.getenv('TOF_HEIGHT', LIDAR_HEIGHT))
+FUEL_CELL_SIZE = float(os.getenv('FUEL_CELL_SIZE', 100.0))  # height grid cell (mm)
+# Fuel-bed height raster of the plot, updated with every scan so its summary is
+# ready in the field
+fuel_bed = HeightGrid(FUEL_CELL_SIZE, datum=-LIDAR_HEIGHT)
+
+# Scans continuously in the background, mapping every rotation as it arrives;
+# collect_data takes the newest buffered rotation. Started once the maps exist
+lidar_reader = LidarReader(lidar, callback=map_scan)
+lidar_reader.start()
+
+# Device health: stage, source and sensor-path latencies are recorded by the orchestrator
+# and the clock; reader counters are read when scraped. Served on localhost only and
+# snapshotted next to the session file
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))  # 0 disables the endpoint
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', 60.0))  # seconds between snapshots
+metrics.counter("tof_readings_total", "ToF readings delivered.", function=lambda: tof_reader.reading_count)
+metrics.counter("dropped_total", "Queued samples overwritten before being read, per source.",
+                function=lambda: tof_reader.dropped, source="tof")
+metrics.counter("dropped_total", "Queued samples overwritten before being read, per source.",
+                function=lambda: session.dropped, source="session")
+metrics.counter("lidar_scans_total", "LiDAR rotations buffered.", function=lambda: lidar_reader.scan_count)
+metrics.counter("errors_total", "Read errors, per source.",
+                function=lambda: lidar_reader.errors, source="lidar")
+metrics.counter("errors_total", "Read errors, per source.", function=lambda: tof_reader.errors, source="tof")
+metrics.counter("errors_total", "Read errors, per source.", function=lambda: kalman.errors, source="imu")
+metrics.counter("imu_samples_total", "IMU samples filtered.", function=lambda: kalman.samples)
+metrics.counter("scan_matches_total", "Scan-to-scan matches, per outcome.",
+                function=lambda: scan_matcher.matched, outcome="matched")
+metrics.counter("scan_matches_total", "Scan-to-scan matches, per outcome.",
+                function=lambda: scan_matcher.failed, outcome="failed")
+metrics.counter("uploads_total", "Upload jobs completed.", function=lambda: uploader.uploaded)
+metrics.counter("upload_failures_total", "Upload attempts that failed.", function=lambda: uploader.failures)
+metrics.counter("uploads_abandoned_total", "Upload jobs set aside after repeated rejection.",
+                function=lambda: uploader.abandoned)
+metrics.gauge("upload_pending", "Upload jobs waiting on disk.", function=lambda: uploader.pending())
+metrics_server = MetricsServer(metrics, METRICS_PORT) if METRICS_PORT else None
+if metrics_server is not None:
+    metrics_server.start()
+metrics_snapshots = SnapshotWriter(metrics, os.path.splitext(session.path)[0] + "_metrics.json",
+                                   METRICS_INTERVAL)
+metrics_snapshots.start()
 
 def capture_image(output_path):
     """Capture an image using the Raspberry Pi camera."""
-    try:
-        cmd = f"libcamera-still --output {output_path} --timeout 5000 --tuning-file /usr/share/libcamera/ipa/rpi/pisp/imx519.json"
-        subprocess.run(cmd, shell=True, check=True)
-        print(f"Image captured and saved as {output_path}")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Camera command failed with exit code {e.returncode}")
-        return False
-    except Exception as e:
-        print(f"Error capturing image: {str(e)}")
-        return False
+    return camera.capture_image(output_path)
 
 def upload_image(image_path):
-    """Upload an image to Firebase storage and return the public URL."""
-    blob = bucket.blob(os.path.basename(image_path))
-    blob.upload_from_filename(image_path, content_type='image/jpeg')
-    return blob.public_url
+    """Queue an image for upload to Firebase storage and return its public URL."""
+    return uploader.enqueue_file(image_path, os.path.basename(image_path), 'image/jpeg')
 
 def get_orientation():
-    """Get the orientation (yaw, pitch, roll) from the BNO055 sensor."""
-    if imu_sensor.euler:
-        yaw, roll, pitch = imu_sensor.euler
+    """Get the orientation (yaw, pitch, roll) from the newest BNO055 sample."""
+    latest = imu_stream.latest()
+    if latest is not None:
+        yaw, roll, pitch = latest[1][EULER]
         return yaw, pitch, roll
     return 0, 0, 0  # Default to 0s if no data is available
 
-def polar_to_3D(distance, angle, yaw, pitch):
-    """Convert polar coordinates to 3D coordinates."""
-    angle_rad = np.radians(angle + yaw)
-    pitch_rad = np.radians(pitch)
-    x = distance * np.cos(angle_rad) * np.cos(pitch_rad)
-    y = distance * np.sin(angle_rad) * np.cos(pitch_rad)
-    z = distance * np.sin(pitch_rad)
-    return x, y, z
-
 def collect_data():
     """Collects data from all sensors if image capture is successful."""
-    # Collect LiDAR data
-    point_cloud = []
+    # Runs alongside the camera exposure, so this is the capture instant for the IMU
+    captured = sensor_clock.now()
+    # Collect LiDAR data, transforming the whole scan at once
     yaw, pitch, roll = get_orientation()
-    for _, angle, distance in next(lidar.iter_scans()):
-        if distance > 0:
-            x, y, z = polar_to_3D(distance, angle, yaw, pitch)
-            point_cloud.append((x, y, z))
-
-    # Wait for TOF sensor data or timeout
-    timeout_start = time.time()
-    while not tof_sensor.data_ready:
-        if time.time() - timeout_start > TIMEOUT:
-            print("Timeout waiting for TOF sensor data.")
-            break
-
-    if tof_sensor.data_ready:
-        tof_sensor.clear_interrupt()
-        distance = tof_sensor.distance - TOF_CALIBRATION
-        timestamp = time.time()
-        # Get sensor data
-        accelerometer_data = imu_sensor.acceleration
-        magnetometer_data = imu_sensor.magnetic
-        gyroscope_data = imu_sensor.gyro
-        euler_data = imu_sensor.euler
-        quaternion_data = imu_sensor.quaternion
-        linear_acceleration_data = imu_sensor.linear_acceleration
-        gravity_data = imu_sensor.gravity
-        temperature = imu_sensor.temperature
-
-        # Kalman filter update
-        z = np.array([accelerometer_data[0], accelerometer_data[1], accelerometer_data[2]])
-        kf.predict()
-        kf.update(z)
-
-        filtered_state = kf.x.tolist()  # Convert ndarray to list
-        return {
+    latest = lidar_reader.latest()
+    lidar_timestamp, scan = latest if latest else (None, [])
+    # Place the scan with its scan-matched pose when there is one, the IMU yaw otherwise
+    pose = scan_matcher.pose_at(lidar_timestamp) if latest else None
+    if pose is not None:
+        yaw = pose.heading
+    angles, distances, qualities = scan_to_arrays(scan)
+    points, mask = place_scan(angles, distances, qualities, yaw, pitch, pose)
+    point_cloud = PointCloud(len(points), timestamp=lidar_timestamp)
+    point_cloud.append(points, quality=qualities[mask])
+
+    # Use a fresh TOF reading, or wait for the next one up to the timeout
+    reading = tof_reader.latest(max_age=TIMEOUT) or tof_reader.wait_next(TIMEOUT)
+    if reading is None:
+        print("Timeout waiting for TOF sensor data.")
+    # IMU values at the capture instant, interpolated between the samples either side of it
+    # A sample after the capture must have arrived, or at() would hand back an older one
+    sample = imu_stream.at(captured) if imu_stream.wait_for(captured, TIMEOUT) else None
+    if sample is None:
+        print("Timeout waiting for IMU data.")
+
+    if reading is not None and sample is not None:
+        distance = reading.distance - TOF_CALIBRATION
+        # The ToF looks straight down from the device, at the origin of the scan frame,
+        # placed by the scan taken closest to the reading rather than the capture's scan
+        tof_pose = scan_matcher.pose_near(reading.timestamp)
+        position = (tof_pose.x, tof_pose.y) if tof_pose is not None else (0.0, 0.0)
+        with map_lock:
+            fuel_bed.insert_heights(position, TOF_HEIGHT - distance * 10.0)
+            fuel_summary = fuel_bed.summary()
+        imu_timestamp, row = sample
+        imu = to_snapshot(row[:IMU_WORDS], int(round(row[IMU_TEMPERATURE])), imu_timestamp)
+        timestamp = sensor_clock.to_wall(imu.timestamp)
+        accelerometer_data = imu.acceleration
+        magnetometer_data = imu.magnetic
+        gyroscope_data = imu.gyro
+        euler_data = imu.euler
+        quaternion_data = imu.quaternion
+        linear_acceleration_data = imu.linear_acceleration
+        gravity_data = imu.gravity
+        temperature = imu.temperature
+
+        # State of the filter running at the IMU rate, at the same instant
+        filtered_state = row[IMU_STATE].tolist()  # Convert ndarray to list
+        sensor_data = {
             "Timestamp": timestamp,
             "Height (cm)": distance,
             "Accelerometer (ms^2)": accelerometer_data,
@@ -136,66 +329,206 @@ def collect_data():
             "Linear acceleration (ms^2)": linear_acceleration_data,
             "Gravity (ms^2)": gravity_data,
             "Temperature (degrees C)": temperature,
-            "Filtered state": filtered_state
-        }, point_cloud
+            "Filtered state": filtered_state,
+            "Pose (mm, degrees)": [pose.x, pose.y, pose.heading] if pose is not None else None,
+            "Fuel bed": fuel_summary,
+            # Monotonic acquisition stamps (ns) of each sensor sample, for fusion
+            "IMU timestamp (ns)": imu.timestamp,
+            "TOF timestamp (ns)": reading.timestamp,
+            "LiDAR timestamp (ns)": lidar_timestamp
+        }
+        session.log_json(imu.timestamp, sensor_data)
+        return sensor_data, point_cloud
     return {}, point_cloud
 
 def log_data(data, image_url, point_cloud):
-    """Log sensor data and point cloud to Firebase."""
-    ref = db.reference('sensor_data_latest')
-    new_data_ref = ref.push()
+    """Queue sensor data and a reference to the encoded point cloud for Firebase."""
     data["image_url"] = image_url
-    data["point_cloud"] = point_cloud
-    new_data_ref.set(data)
+    if point_cloud:
+        # The cloud goes to Storage as a compact quantized blob; the record only references it
+        cloud_name = f"cloud_{sensor_clock.to_wall_ns(point_cloud.timestamp)}.wbpc"
+        cloud_path = os.path.join(os.getcwd(), cloud_name)
+        with open(cloud_path, "wb") as f:
+            f.write(pc_codec.encode(point_cloud.xyz, CLOUD_PRECISION))
+        data["point_cloud_url"] = uploader.enqueue_file(cloud_path, cloud_name, pc_codec.CONTENT_TYPE)
+        data["point_cloud_points"] = len(point_cloud)
+        data["point_cloud_precision"] = CLOUD_PRECISION
+    uploader.enqueue_record('sensor_data_latest', data)
+
+def save_map():
+    """Encode the accumulated voxel and occupancy maps and queue them for upload."""
+    if occupancy_map.scans:
+        occupancy_name = f"occupancy_{time.time_ns()}.npz"
+        occupancy_path = os.path.join(os.getcwd(), occupancy_name)
+        occupancy_map.save(occupancy_path)
+        uploader.enqueue_file(occupancy_path, occupancy_name, "application/octet-stream")
+        print(f"Occupancy map: {occupancy_map.scans} scans, saved to {occupancy_path}")
+    with map_lock:
+        if not len(voxel_map):
+            return
+        centroids = voxel_map.centroids()
+    map_name = f"map_{time.time_ns()}.wbpc"
+    map_path = os.path.join(os.getcwd(), map_name)
+    with open(map_path, "wb") as f:
+        f.write(pc_codec.encode(centroids, CLOUD_PRECISION))
+    uploader.enqueue_file(map_path, map_name, pc_codec.CONTENT_TYPE)
+    print(f"Voxel map: {len(voxel_map)} voxels from {voxel_map.points} points, saved to {map_path}")
 
 def visualize_point_cloud(point_cloud):
-    """Visualize the 3D point cloud collected from LiDAR."""
-    if point_cloud:
-        fig = plt.figure()
-        ax = fig.add_subplot(111, projection='3d')
-        xs, ys, zs = zip(*point_cloud)
-        ax.scatter(xs, ys, zs, s=1)
-        ax.set_xlabel('X (cm)')
-        ax.set_ylabel('Y (cm)')
-        ax.set_zlabel('Z (cm)')
-        plt.show()
-
-try:
-    while True:
-        start_time = time.time()
-        output_path = os.path.join(os.getcwd(), f"image_{int(time.time())}.jpg")
-        
-        if capture_image(output_path):
-            image_url = upload_image(output_path)
-            sensor_data, point_cloud = collect_data()
-            log_data(sensor_data, image_url, point_cloud)
-            visualize_point_cloud(point_cloud)  # Visualize point cloud
-            print("Point cloud visualization completed.")
-            
-            # Display collected data
-            print(f"Sensor Data: {sensor_data}")
-            print(f"TOF Distance: {sensor_data['Height (cm)']} cm")
-            print(f"Temperature: {sensor_data['Temperature (degrees C)']} degrees C")
-            print(f"Accelerometer: {sensor_data['Accelerometer (ms^2)']}")
-            print(f"Magnetometer: {sensor_data['Magnetometer (microteslas)']}")
-            print(f"Gyroscope: {sensor_data['Gyroscope (radsec)']}")
-            print(f"Euler angles: {sensor_data['Euler angle']}")
-            print(f"Quaternion: {sensor_data['Quaternion']}")
-            print(f"Linear acceleration: {sensor_data['Linear acceleration (ms^2)']}")
-            print(f"Gravity: {sensor_data['Gravity (ms^2)']}")
-            print(f"Filtered state: {sensor_data['Filtered state']}")
-            print(f"Image URL: {image_url}")
-
-        else:
-            print("Image capture failed, skipping sensor and LiDAR reading.")
-
-        time_to_sleep = INTERVAL - (time.time() - start_time)
-        if time_to_sleep > 0:
-            time.sleep(time_to_sleep)
-except KeyboardInterrupt:
-    print("Program interrupted.")
-except Exception as e:
-    print(f"Unexpected error: {str(e)}")
-finally:
-    lidar.stop()
-    lidar.disconnect()
+    """Hand the 3D point cloud to the rendering process, dropping it if rendering lags."""
+    if point_cloud and renderer is not None:
+        renderer.submit(point_cloud.xyz)
+
+def acquire_image():
+    """Capture an image and return its path, or None if the camera failed."""
+    # Nanosecond wall-clock names never collide, even at several captures per second
+    with sensor_clock.measure("camera") as started:
+        output_path = os.path.join(os.getcwd(), f"image_{sensor_clock.to_wall_ns(started)}.jpg")
+        captured = capture_image(output_path)
+    if captured:
+        session.log_image(started, output_path)
+    return output_path if captured else None
+
+def upload_derivatives(future):
+    """Done-callback of a derivatives job: queue them for upload ahead of full-size originals."""
+    try:
+        paths = future.result()
+    except Exception as e:
+        print(f"Error building image derivatives: {str(e)}")
+        return
+    for path in paths.values():
+        uploader.enqueue_file(path, os.path.basename(path), mimetypes.guess_type(path)[0],
+                              priority=PREVIEW_PRIORITY)
+
+def derivatives_stage(record):
+    """Start the thumbnail and preview of a capture, dropping the record if the capture failed.
+
+    The record goes on with the derivatives' URLs, which are known in advance, so its
+    upload and logging never wait on JPEG decoding.
+    """
+    if record["image_path"] is None:
+        print("Image capture failed, skipping sensor and LiDAR reading.")
+        return None
+    derivative_pool.submit(record["image_path"]).add_done_callback(upload_derivatives)
+    record["derivative_urls"] = {kind: uploader.public_url(os.path.basename(path))
+                                 for kind, path in derivative_pool.paths(record["image_path"]).items()}
+    return record
+
+def upload_stage(record):
+    """Queue the full-size original for upload."""
+    record["image_url"] = upload_image(record["image_path"])
+    return record
+
+def log_stage(record):
+    """Log the sensor data and point cloud of a capture and print a summary."""
+    sensor_data, point_cloud = record["sensors"]
+    image_url = record["image_url"]
+    sensor_data["image_derivatives"] = record["derivative_urls"]
+    log_data(sensor_data, image_url, point_cloud)
+
+    # Display collected data
+    print(f"Sensor Data: {sensor_data}")
+    if "Height (cm)" in sensor_data:
+        print(f"TOF Distance: {sensor_data['Height (cm)']} cm")
+        print(f"Temperature: {sensor_data['Temperature (degrees C)']} degrees C")
+        print(f"Accelerometer: {sensor_data['Accelerometer (ms^2)']}")
+        print(f"Magnetometer: {sensor_data['Magnetometer (microteslas)']}")
+        print(f"Gyroscope: {sensor_data['Gyroscope (radsec)']}")
+        print(f"Euler angles: {sensor_data['Euler angle']}")
+        print(f"Quaternion: {sensor_data['Quaternion']}")
+        print(f"Linear acceleration: {sensor_data['Linear acceleration (ms^2)']}")
+        print(f"Gravity: {sensor_data['Gravity (ms^2)']}")
+        print(f"Filtered state: {sensor_data['Filtered state']}")
+        print(f"Fuel bed: {sensor_data['Fuel bed']}")
+    print(f"Image URL: {image_url}")
+    return record
+
+def visualize_stage(record):
+    """Visualize the point cloud of a capture."""
+    visualize_point_cloud(record["sensors"][1])
+    return record
+
+def build_pipeline():
+    """Wire the capture sources and the stages each record passes through."""
+    orchestrator = Orchestrator(INTERVAL)
+    # Camera exposure and sensor reads overlap within each cycle
+    orchestrator.add_source("image_path", acquire_image)
+    orchestrator.add_source("sensors", collect_data)
+    # Cloud I/O queues up rather than losing records; the plot only ever shows the newest cloud
+    orchestrator.add_stage("derivatives", derivatives_stage, policy=BLOCK, maxsize=QUEUE_SIZE)
+    orchestrator.add_stage("upload", upload_stage, policy=BLOCK, maxsize=QUEUE_SIZE)
+    orchestrator.add_stage("log", log_stage, policy=BLOCK, maxsize=QUEUE_SIZE)
+    if renderer is not None:
+        orchestrator.add_stage("visualize", visualize_stage, policy=DROP_OLDEST, maxsize=1)
+    return orchestrator
+
+async def main(orchestrator, cycles=None):
+    """Run capture, sensor collection, upload, logging and visualization concurrently."""
+    try:
+        await orchestrator.run(cycles)
+    finally:
+        print(f"Pipeline stats: {orchestrator.stats()}")
+        print(f"Sensor latency: {sensor_clock.latency()}")
+        print(f"Sensor tasks: {scheduler.stats()}")
+
+def write_stats(path, orchestrator, elapsed):
+    """Write the run's stage, source and sensor-path latencies and resource use as JSON."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    stages = orchestrator.stats()
+    # A capture is complete once it has been logged
+    captures = stages["log"]["processed"] if "log" in stages else 0
+    stats = {
+        "elapsed_s": elapsed,
+        "cycles": orchestrator.cycles,
+        "captures": captures,
+        "captures_per_s": captures / elapsed if elapsed else 0.0,
+        "speed": SPEED,
+        "stages": stages,
+        "sources": orchestrator.source_stats(),
+        "paths": sensor_clock.latency(),
+        "tasks": scheduler.stats(),
+        "cpu_s": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        # ru_maxrss is in KiB on Linux
+        "max_rss_mb": own.ru_maxrss / 1024.0,
+        "children_max_rss_mb": children.ru_maxrss / 1024.0,
+    }
+    with open(path, "w") as f:
+        json.dump(stats, f, indent=2)
+
+if __name__ == "__main__":
+    if args.trace:
+        tracer.enable()
+        # Dump on demand from a short-lived thread, so the capture loop is not held up
+        signal.signal(signal.SIGUSR1, lambda *_: threading.Thread(
+            target=tracer.dump, args=(args.trace,), name="trace-dump").start())
+    started = time.monotonic()
+    orchestrator = build_pipeline()
+    try:
+        asyncio.run(main(orchestrator, args.cycles))
+    except KeyboardInterrupt:
+        print("Program interrupted.")
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
+    finally:
+        elapsed = time.monotonic() - started
+        if renderer is not None:
+            renderer.close()
+        camera.close()
+        derivative_pool.close()
+        save_map()
+        uploader.stop()
+        scheduler.stop()
+        tof_reader.stop()
+        lidar_reader.stop()
+        lidar.stop_motor()
+        lidar.disconnect()
+        # Closed after the readers, which log to it until they stop
+        session.close()
+        metrics_snapshots.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if args.stats:
+            write_stats(args.stats, orchestrator, elapsed)
+        if args.trace:
+            print(f"Trace: {tracer.dump(args.trace)} spans written to {args.trace}")